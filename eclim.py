@@ -6,16 +6,50 @@ It should be independent of any Sublime Text 2 API.
 There is one global variable 'eclim_executable' that needs to be set before
 using the module. It should point to the "eclim" executable in your Eclipse
 directory.
+
+Optionally, 'nailgun_address' can be set to the (host, port) of eclimd's
+Nailgun server. Commands are then sent to the server directly, which saves
+spawning the "eclim" script and the "ng" client for every call.
+
+Calls block the calling thread for at most 'default_timeout' seconds.
+call_eclim_async and submit run calls on a few dispatcher threads instead
+and return an EclimFuture that can be waited for, cancelled or timed out.
+Calls can be given a supersede key (e.g. view id + action): starting a call
+with the same key cancels the older one.
+
+The output of read-only commands is cached in 'result_cache' until a
+command or invalidate_cache() signals that sources or projects changed.
+
+After repeated connection failures, 'breaker' opens: calls fail fast until
+a background ping finds the server again, see server_available().
+
+If 'eclimd_executable' points to the "eclimd" script, start_eclimd()
+launches a headless server and restarts it should it crash.
 '''
 import os
+import re
 import json
+import time
+import heapq
+import random
+import shlex
+import itertools
+import threading
 import subprocess
 try:
     # Python 3
     from . import subclim_logging
+    from . import nailgun
+    from . import eclimd
+    from . import subclim_overlay
+    import queue
 except (ValueError):
     # Python 2
     import subclim_logging
+    import nailgun
+    import eclimd
+    import subclim_overlay
+    import Queue as queue
 
 try:
     unicode
@@ -25,6 +59,67 @@ except NameError:
 
 # points to eclim executable, see module-level comments
 eclim_executable = None
+# (host, port) of eclimd's nailgun server, see module-level comments
+nailgun_address = None
+# points to the eclimd executable, see module-level comments
+eclimd_executable = None
+# the eclimd.EclimdSupervisor of the server started by start_eclimd
+supervisor = None
+# number of connections kept open to each eclimd and how long (in seconds)
+# an unused one is kept around
+nailgun_pool_size = 2
+nailgun_max_idle = 60.0
+
+# seconds a call may take before it is aborted, None waits forever
+default_timeout = 30.0
+# number of dispatcher threads for asynchronous calls
+async_workers = 8
+
+# connection pools by (host, port), shared by all threads
+_pools = {}
+_pools_lock = threading.Lock()
+
+# (command, project, file) -> (file stamp, output) of the last *_src_update
+_src_updates = {}
+
+# the EclimFuture of the asynchronous call a dispatcher thread is running
+_current = threading.local()
+# whether this thread's calls see an overlaid file, see with_overlay
+_overlay = threading.local()
+_async_queue = queue.Queue()
+_async_threads = []
+_async_lock = threading.Lock()
+
+# argument tuple -> Flight of the identical command currently running
+_flights = {}
+_flights_lock = threading.Lock()
+
+# counters, see stats()
+_stats = {'executed': 0, 'coalesced': 0}
+
+# read-only commands whose output only depends on the projects' setup
+PROJECT_QUERIES = frozenset([
+    'projects', 'project_info', 'project_natures',
+    'project_by_resource', 'workspace_dir', 'java_classpath',
+    'java_classpath_variables', 'java_src_dirs', 'java_list_installs'])
+# read-only commands whose output also depends on the sources
+SOURCE_QUERIES = frozenset([
+    'java_search', 'java_hierarchy', 'java_docsearch', 'java_src_find'])
+# commands that neither are cached nor change anything; project_list
+# is kept by project_index instead
+NEUTRAL_COMMANDS = frozenset(['ping', 'problems', 'jobs', 'locate_file', 'project_list'])
+
+# bumped whenever sources / projects may have changed, part of cache keys
+_generations = {'source': 0, 'project': 0}
+
+# supersede key -> EclimFuture of the newest call made with that key
+_latest = {}
+_latest_lock = threading.Lock()
+
+# marks "use default_timeout", as None means no timeout
+DEFAULT = object()
+
+clock = getattr(time, 'monotonic', time.time)
 
 log = subclim_logging.getLogger('subclim')
 
@@ -33,12 +128,696 @@ class EclimExecutionException(Exception):
     pass
 
 
+class EclimTimeoutException(EclimExecutionException):
+    pass
+
+
+class EclimConnectionException(EclimExecutionException):
+    pass
+
+
+class EclimCancelledException(EclimExecutionException):
+    pass
+
+
 class NotInEclipseProjectException(Exception):
     pass
 
 
-def call_eclim(cmdline):
-    ''' Generic call to eclim including error-handling '''
+class EclimFuture(object):
+    '''The pending result of an eclim call. Cancelling it or running into
+    its deadline aborts the eclim process or connection in use.'''
+
+    def __init__(self, timeout=None):
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+        self._abort = None
+        self.deadline = None
+        if timeout is not None:
+            self.deadline = clock() + timeout
+            _watchdog.watch(self)
+
+    def done(self):
+        return self._done.is_set()
+
+    def cancelled(self):
+        return isinstance(self._exception, EclimCancelledException)
+
+    def aborted(self):
+        '''True if cancelled or timed out'''
+        return isinstance(self._exception, (EclimCancelledException, EclimTimeoutException))
+
+    def cancel(self, reason='Eclim call cancelled'):
+        '''Returns False if the call already finished'''
+        return self._finish(exception=EclimCancelledException(reason))
+
+    def _expire(self):
+        self._finish(exception=EclimTimeoutException('Eclim did not answer in time'))
+
+    def set_result(self, result):
+        self._finish(result=result)
+
+    def set_exception(self, exception):
+        self._finish(exception=exception)
+
+    def set_abort(self, abort):
+        '''Registers a function that stops the running transport, or None
+        once it finished. Aborts right away if the call was already
+        cancelled or timed out.'''
+        with self._lock:
+            if not self._done.is_set():
+                self._abort = abort
+                return
+        if abort is not None and self.aborted():
+            run_abort(abort)
+
+    def _finish(self, result=None, exception=None):
+        with self._lock:
+            if self._done.is_set():
+                return False
+            self._result = result
+            self._exception = exception
+            abort, self._abort = self._abort, None
+            callbacks, self._callbacks = self._callbacks, []
+            self._done.set()
+        if abort is not None and self.aborted():
+            run_abort(abort)
+        for callback in callbacks:
+            self._run_callback(callback)
+        return True
+
+    def result(self, timeout=None):
+        '''Waits for the result, raises the call's exception if it failed'''
+        self._done.wait(timeout)
+        if not self._done.is_set():
+            raise EclimTimeoutException('Eclim did not answer in time')
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def add_done_callback(self, callback):
+        '''Calls callback(future) once done, on the thread that finishes it'''
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        self._run_callback(callback)
+
+    def _run_callback(self, callback):
+        try:
+            callback(self)
+        except Exception:
+            log.exception('Error in eclim callback')
+
+
+class Watchdog(object):
+    '''Expires futures at their deadline. One thread serves all calls, so a
+    deadline costs no more than a heap entry.'''
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = itertools.count()
+        self._thread = None
+
+    def watch(self, future):
+        with self._cond:
+            heapq.heappush(self._heap, (future.deadline, next(self._seq), future))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run)
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+
+    def run(self):
+        while True:
+            with self._cond:
+                while True:
+                    while self._heap and self._heap[0][2].done():
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    wait = self._heap[0][0] - clock()
+                    if wait <= 0:
+                        future = heapq.heappop(self._heap)[2]
+                        break
+                    self._cond.wait(wait)
+            future._expire()
+
+_watchdog = Watchdog()
+
+
+def supersede(key, future):
+    '''Makes future the newest call for key and cancels the previous one'''
+    if key is None:
+        return
+    with _latest_lock:
+        previous = _latest.get(key)
+        _latest[key] = future
+    if previous is not None and previous.cancel('Eclim call superseded'):
+        log.info('Superseded eclim call %s', key)
+
+    def forget(f):
+        with _latest_lock:
+            if _latest.get(key) is f:
+                del _latest[key]
+    future.add_done_callback(forget)
+
+
+def cancel(key):
+    '''Cancels the pending call made with key, if any'''
+    with _latest_lock:
+        pending = _latest.get(key)
+    if pending is not None:
+        pending.cancel()
+
+
+def run_abort(abort):
+    try:
+        abort()
+    except Exception as e:
+        log.info('Aborting eclim call failed: %s', e)
+
+
+def submit(fn, args=(), timeout=DEFAULT, key=None):
+    '''Runs fn(*args) on a dispatcher thread and returns an EclimFuture for
+    its result. The future's timeout and cancellation apply to all eclim
+    calls fn makes. A pending call with the same key is cancelled.'''
+    if timeout is DEFAULT:
+        timeout = default_timeout
+    future = EclimFuture(timeout)
+    supersede(key, future)
+    with _async_lock:
+        while len(_async_threads) < async_workers:
+            t = threading.Thread(target=async_worker)
+            t.daemon = True
+            t.start()
+            _async_threads.append(t)
+    _async_queue.put((future, fn, args))
+    return future
+
+
+def async_worker():
+    while True:
+        future, fn, args = _async_queue.get()
+        # skip calls cancelled or timed out while waiting
+        if future.done():
+            continue
+        _current.call = future
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            _current.call = None
+
+
+def call_eclim_async(cmdline, timeout=DEFAULT, key=None):
+    '''Like call_eclim, but returns an EclimFuture right away'''
+    return submit(call_eclim, (cmdline,), timeout, key)
+
+
+def call_eclim_batch_async(cmdlines, timeout=DEFAULT, key=None):
+    '''Like call_eclim_batch, but returns an EclimFuture right away'''
+    return submit(call_eclim_batch, (cmdlines,), timeout, key)
+
+
+def check_aborted(call):
+    if call.aborted():
+        call.result()
+
+
+def call_eclim(cmdline, timeout=DEFAULT, key=None):
+    ''' Generic call to eclim including error-handling.
+    Inside submit or run_as_call, the enclosing call's timeout and key
+    apply instead of the given ones. '''
+    call = getattr(_current, 'call', None)
+    own_call = call is None
+    if own_call:
+        call = EclimFuture(default_timeout if timeout is DEFAULT else timeout)
+        supersede(key, call)
+    try:
+        check_aborted(call)
+        args = arg_list(cmdline)
+        # the output of an overlaid file must neither be shared nor kept
+        overlaid = getattr(_overlay, 'active', False)
+        cache_key = None if overlaid else result_cache_key(args)
+        if cache_key is not None:
+            out = result_cache.get(cache_key)
+            if out is not None:
+                log.info('Cached: %s', args)
+                return out
+        breaker.check()
+        try:
+            if overlaid:
+                with _flights_lock:
+                    _stats['executed'] += 1
+                out = execute(cmdline, call)
+            else:
+                out = coalesce(args, call, lambda: execute(cmdline, call))
+        finally:
+            call.set_abort(None)
+            note_changes(args)
+        if cache_key is not None:
+            result_cache.put(cache_key, out)
+        return out
+    finally:
+        if own_call:
+            call.set_result(None)
+
+
+def execute(cmdline, call):
+    try:
+        out, err = run_transport(cmdline, call)
+    except Exception:
+        check_aborted(call)
+        raise
+    check_aborted(call)
+    log.debug("Results:\n" + out)
+    try:
+        out = check_output(out, err)
+    except EclimConnectionException:
+        breaker.failure()
+        raise
+    breaker.success()
+    return out
+
+
+class Flight(object):
+    '''One execution of a command, shared by identical concurrent calls'''
+    def __init__(self):
+        self.waiters = []
+        self.result = None
+        self.exception = None
+
+
+def coalesce(args, call, fn):
+    '''Returns fn(), unless an identical command is running already. Then
+    waits for that one and shares its output (or error) instead. If the
+    running call gets cancelled or times out, the waiting ones retry.'''
+    key = tuple(args)
+    while True:
+        with _flights_lock:
+            flight = _flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _flights[key] = Flight()
+                _stats['executed'] += 1
+            else:
+                wake = threading.Event()
+                flight.waiters.append(wake)
+                _stats['coalesced'] += 1
+        if leader:
+            try:
+                flight.result = fn()
+                return flight.result
+            except Exception as e:
+                flight.exception = e
+                raise
+            finally:
+                with _flights_lock:
+                    del _flights[key]
+                    waiters = flight.waiters
+                for wake in waiters:
+                    wake.set()
+
+        log.info('Coalesced with running call: %s', args)
+        call.set_abort(wake.set)
+        wake.wait()
+        call.set_abort(None)
+        check_aborted(call)
+        if isinstance(flight.exception, (EclimCancelledException, EclimTimeoutException)):
+            with _flights_lock:
+                _stats['coalesced'] -= 1
+            continue
+        if flight.exception is not None:
+            raise flight.exception
+        return flight.result
+
+
+def stats():
+    '''Counters of this module: 'executed' commands, 'coalesced' calls that
+    shared the output of an identical running one and the result cache's
+    'cache_hits' and 'cache_misses' '''
+    with _flights_lock:
+        counters = dict(_stats)
+    counters['cache_hits'] = result_cache.hits
+    counters['cache_misses'] = result_cache.misses
+    return counters
+
+
+class ResultCache(object):
+    '''LRU cache for command outputs, bounded by the number of entries
+    and by the total size of the outputs.'''
+
+    def __init__(self, max_entries=256, max_size=4 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # key -> [time of last use, output]; no OrderedDict in Python 2.6
+        self._entries = {}
+        self._clock = itertools.count()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            entry[0] = next(self._clock)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        if len(value) > self.max_size:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old[1])
+            self._entries[key] = [next(self._clock), value]
+            self._size += len(value)
+            while len(self._entries) > self.max_entries or self._size > self.max_size:
+                entries = self._entries
+                oldest = min(entries, key=lambda k: entries[k][0])
+                self._size -= len(entries.pop(oldest)[1])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+result_cache = ResultCache()
+
+
+def command_name(args):
+    if len(args) >= 2 and args[0] == '-command':
+        return args[1]
+    return None
+
+
+def result_cache_key(args):
+    '''Key under which the output of the given command is cached,
+    None if the command must always run'''
+    command = command_name(args)
+    if command in PROJECT_QUERIES:
+        return (None, _generations['project'], tuple(args))
+    if command in SOURCE_QUERIES:
+        return (_generations['source'], _generations['project'], tuple(args))
+    return None
+
+
+def note_changes(args):
+    '''Invalidates cached outputs the given command may have made stale.
+    Sources can be shared between projects, so any change invalidates
+    the source queries of all projects.'''
+    command = command_name(args)
+    if command is None or command in PROJECT_QUERIES or command in SOURCE_QUERIES:
+        return
+    if command in NEUTRAL_COMMANDS or command.endswith(('_complete', '_validate')):
+        return
+    if command.endswith('_src_update'):
+        invalidate_cache()
+    else:
+        # refactorings, formatting, project_* changes, ...
+        invalidate_cache(projects=True)
+
+
+def invalidate_cache(projects=False):
+    '''To be called when sources were changed, e.g. on save. With
+    projects=True, cached project setups are dropped too.'''
+    with _flights_lock:
+        _generations['source'] += 1
+        if projects:
+            _generations['project'] += 1
+    if projects:
+        project_index.invalidate()
+
+
+def run_transport(cmdline, call):
+    '''Runs the command via nailgun or eclim_executable, returns (out, err)'''
+    if nailgun_address is not None:
+        try:
+            return run_nailgun(cmdline, call)
+        except nailgun.NailgunConnectionError as e:
+            log.info(e)
+            return "connect: Connection refused", ""
+        except nailgun.NailgunError as e:
+            check_aborted(call)
+            if not eclim_executable:
+                raise EclimExecutionException('Error connecting to Eclim server: %s' % e)
+            log.info('Nailgun call failed (%s), falling back to %s', e, eclim_executable)
+    return run_subprocess(cmdline, call)
+
+
+def call_eclim_batch(cmdlines, timeout=DEFAULT, key=None):
+    '''Runs several commands as one unit and returns their outputs in order.
+    Stops at the first failing command by raising its EclimExecutionException.
+    The timeout applies to the whole batch; a newer call with the same key
+    cancels the rest of it.
+
+    *_src_update commands whose file did not change since the last update
+    of it are not sent again; their previous output is returned instead.'''
+    return run_as_call(run_batch, (cmdlines,), timeout, key)
+
+
+def call_eclim_batch_overlay(project, filename, contents, cmdlines,
+                             timeout=DEFAULT, key=None):
+    '''Like call_eclim_batch, but the commands see contents (bytes) instead
+    of what is saved in the given file of the project, e.g. an unsaved
+    buffer.'''
+    updates = [args for args in map(arg_list, cmdlines)
+               if (command_name(args) or '').endswith('_src_update')]
+    update_cmd = updates[0] if updates else None
+    return run_as_call(with_overlay, (project, filename, contents,
+                                      lambda: run_batch(cmdlines), update_cmd), timeout, key)
+
+
+def run_batch(cmdlines):
+    cmdlines = [arg_list(cmdline) for cmdline in cmdlines]
+    # the rest of the batch has to see the file its update read
+    paths = [p for p in map(src_update_path, cmdlines) if p is not None]
+    if not paths:
+        return run_commands(cmdlines)
+    with subclim_overlay.file_lock(paths[0]):
+        return run_commands(cmdlines)
+
+
+def run_commands(cmdlines):
+    outputs = []
+    for args in cmdlines:
+        key, stamp = src_update_stamp(args)
+        previous = _src_updates.get(key)
+        if stamp is not None and previous is not None and previous[0] == stamp:
+            log.info('Skip up-to-date: %s', args)
+            outputs.append(previous[1])
+            continue
+        out = call_eclim(args)
+        if stamp is not None:
+            _src_updates[key] = (stamp, out)
+        outputs.append(out)
+    return outputs
+
+
+def run_as_call(fn, args, timeout=DEFAULT, key=None):
+    '''Runs fn(*args) on this thread as a single call: all eclim calls it
+    makes share one timeout and supersede key. Inside submit or another
+    run_as_call, the enclosing call's timeout and key apply instead.'''
+    if getattr(_current, 'call', None) is not None:
+        return fn(*args)
+    call = EclimFuture(default_timeout if timeout is DEFAULT else timeout)
+    supersede(key, call)
+    _current.call = call
+    try:
+        return fn(*args)
+    finally:
+        _current.call = None
+        call.set_result(None)
+
+
+def src_update_path(args):
+    '''The path of the file a *_src_update command reads, None for other
+    commands or if the file can't be located'''
+    if len(args) < 2 or not args[1].endswith('_src_update'):
+        return None
+    opts = dict(zip(args[2::2], args[3::2]))
+    project_path = project_index.project_path(opts.get('-p'))
+    if project_path is None or opts.get('-f') is None:
+        return None
+    return os.path.join(project_path, opts['-f'])
+
+
+def src_update_stamp(args):
+    '''Returns (key, stamp) for *_src_update commands, where stamp changes
+    whenever the updated file changes on disk. (None, None) for other
+    commands or if the file can't be located.'''
+    path = src_update_path(args)
+    if path is None:
+        return None, None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None, None
+    opts = dict(zip(args[2::2], args[3::2]))
+    return (args[1], opts['-p'], opts['-f']), (st.st_mtime, st.st_size)
+
+
+def check_output(out, err):
+    '''Maps the output of an eclim call to an EclimExecutionException
+    if it signals an error, returns the output otherwise'''
+    if err or "Connection refused" in out:
+        error_msg = 'Error connecting to Eclim server: '
+        if out:
+            error_msg += out
+        if err:
+            error_msg += err
+        if "Connection refused" in out:
+            error_msg += " Is Eclipse running?"
+            log.error(error_msg)
+            raise EclimConnectionException(error_msg)
+        log.error(error_msg)
+        raise EclimExecutionException(error_msg)
+    return out
+
+
+class CircuitBreaker(object):
+    '''Counts consecutive connection failures. After 'threshold' of them
+    it opens: calls fail fast with an EclimConnectionException while a
+    background thread pings the server, waiting exponentially longer
+    (with jitter) between pings. The first successful ping closes it.'''
+
+    def __init__(self, threshold=3, min_delay=1.0, max_delay=60.0):
+        self.threshold = threshold
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.failures = 0
+        self._open = False
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        return self._open
+
+    def check(self):
+        if self._open:
+            raise EclimConnectionException(
+                'Eclim server unreachable, waiting for it to come back.')
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._open or self.failures < self.threshold:
+                return
+            self._open = True
+        log.error('Eclim server unreachable, pausing calls until it answers again.')
+        t = threading.Thread(target=self.probe)
+        t.daemon = True
+        t.start()
+
+    def close(self):
+        with self._lock:
+            self.failures = 0
+            self._open = False
+
+    def probe(self):
+        delay = self.min_delay
+        while self._open:
+            time.sleep(random.uniform(delay / 2, delay))
+            if not self._open:
+                return
+            if ping():
+                log.info('Eclim server is back')
+                self.close()
+                return
+            delay = min(delay * 2, self.max_delay)
+
+breaker = CircuitBreaker()
+
+
+def ping():
+    '''Checks whether eclimd is up and answering commands, bypassing the
+    breaker and the error log. The breaker's probe.'''
+    call = EclimFuture(default_timeout)
+    try:
+        out, err = run_transport(['-command', 'ping'], call)
+    except EclimExecutionException:
+        return False
+    finally:
+        call.set_result(None)
+    return bool(out) and not err and "Connection refused" not in out
+
+
+def server_available():
+    '''False while eclimd is known to be unreachable, so that callers can
+    skip work that needs it'''
+    return not breaker.is_open()
+
+
+def arg_list(cmdline):
+    '''Turns a command line as accepted by call_eclim into a list of arguments'''
+    if isinstance(cmdline, basestring):
+        # POSIX mode would drop the backslashes of Windows paths
+        return [unquote(a) for a in shlex.split(cmdline, posix=False)]
+    elif hasattr(cmdline, '__iter__'):
+        return list(cmdline)
+    raise EclimExecutionException('Unknown command line passed. ' + repr(cmdline) + ' ' + str(type(cmdline)))
+
+
+def unquote(arg):
+    if len(arg) > 1 and arg[0] == arg[-1] and arg[0] in '"\'':
+        return arg[1:-1]
+    return arg
+
+
+def run_nailgun(cmdline, call):
+    '''Sends the command to eclimd's nailgun server, returns (out, err)'''
+    args = arg_list(cmdline)
+    log.info('Run (nailgun): %s', args)
+
+    def register(sock):
+        call.set_abort(lambda: nailgun.abort(sock))
+    _, out, err = nailgun_pool().run(args, register, call.aborted)
+    return out.decode('utf-8'), err.decode('utf-8')
+
+
+def nailgun_pool(address=None):
+    '''Returns the shared connection pool for the given address,
+    nailgun_address by default'''
+    address = tuple(address or nailgun_address)
+    with _pools_lock:
+        pool = _pools.get(address)
+        if pool is None:
+            host, port = address
+            pool = nailgun.NailgunPool(host, port, size=nailgun_pool_size,
+                                       max_idle=nailgun_max_idle)
+            _pools[address] = pool
+        return pool
+
+
+def close_nailgun_pools():
+    '''Closes all pooled connections, e.g. after the settings changed'''
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+def run_subprocess(cmdline, call):
+    '''Runs the command through eclim_executable, returns (out, err)'''
     def arg_string(s):
         return "%s %s" % (eclim_executable, s)
 
@@ -56,7 +835,7 @@ def call_eclim(cmdline):
         cmd = arg_seq(cmdline)
         shell = False
     else:
-        raise EclimExecutionException('Unknown command line passed. ' + repr(cmd) + ' ' + (type(cmd)))
+        raise EclimExecutionException('Unknown command line passed. ' + repr(cmdline) + ' ' + str(type(cmdline)))
     log.info('Run: %s', cmd)
 
     # running with shell=False spawns new command windows for
@@ -68,81 +847,299 @@ def call_eclim(cmdline):
         sinfo.wShowWindow = subprocess.SW_HIDE
 
     popen = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=shell, startupinfo=sinfo)
+    call.set_abort(popen.kill)
     out, err = popen.communicate()
-    out = out.decode('utf-8')
-    err = err.decode('utf-8')
-    log.debug("Results:\n" + out)
+    return out.decode('utf-8'), err.decode('utf-8')
+
+
+def start_eclimd(args=(), on_ready=None):
+    '''Launches eclimd_executable in the background and keeps it running
+    until stop_eclimd is called. Does nothing if a server answers already.
+    on_ready() is called whenever the server is ready to take commands,
+    after startup and after restarts.'''
+    global supervisor
+    command = [eclimd_executable] + list(args)
+    if supervisor is not None and supervisor.command == command and supervisor.is_running():
+        if supervisor.is_ready() and on_ready is not None:
+            on_ready()
+        return supervisor
+    stop_eclimd()
+    host, port = nailgun_address or ('localhost', eclimrc_port())
+    client = nailgun.NailgunClient(host, port, timeout=5.0)
+
+    def ready():
+        try:
+            code, out, _ = client.run(['-command', 'ping'])
+        except nailgun.NailgunError:
+            return False
+        return code == 0 and bool(out)
+
+    def ready_now():
+        # calls issued while it was starting up tripped the breaker
+        breaker.close()
+        close_nailgun_pools()
+        if on_ready is not None:
+            on_ready()
+
+    supervisor = eclimd.EclimdSupervisor(
+        command, (host, port), ready_check=ready, on_ready=ready_now,
+        shutdown=lambda: client.run(['-command', 'shutdown']))
+    supervisor.start()
+    return supervisor
+
+
+def stop_eclimd():
+    '''Shuts down the server started by start_eclimd, if any'''
+    global supervisor
+    if supervisor is not None:
+        supervisor.stop()
+        supervisor = None
 
-    # error handling
-    if err or "Connection refused" in out:
-        error_msg = 'Error connecting to Eclim server: '
-        if out:
-            error_msg += out
-        if err:
-            error_msg += err
-        if "Connection refused" in out:
-            error_msg += " Is Eclipse running?"
-        log.error(error_msg)
-        raise EclimExecutionException(error_msg)
-    return out
+
+def eclimrc_port(eclimrc=None):
+    '''Reads the nailgun port from ~/.eclimrc, like the eclim script does.
+    Returns the default port if it is not configured there.'''
+    eclimrc = eclimrc or os.path.expanduser('~/.eclimrc')
+    try:
+        with open(eclimrc) as f:
+            for line in f:
+                m = re.match(r'\s*nailgun\.server\.port\s*=\s*(\d+)', line)
+                if m:
+                    return int(m.group(1))
+    except (IOError, OSError):
+        pass
+    return nailgun.DEFAULT_PORT
 
 
 def get_context(filename):
-    project_path = find_project_dir(filename)
+    if not filename:
+        return None, None
+    project_path = project_index.find_root(os.path.dirname(os.path.abspath(filename)))
     if not project_path:
         return None, None
 
-    project_path = os.path.abspath(project_path)
-    cmd = '-command project_list'
-    out = call_eclim(cmd)
-    if not out:
+    name = project_index.project_name(project_path)
+    if name is None:
         return None, None
-
-    try:
-        obj = json.loads(out)
-        for item in obj:
-            path = os.path.abspath(item['path'])
-            if path == project_path:
-                relative = os.path.relpath(filename, project_path)
-                return item['name'], relative
-    except ValueError:
-        subclim_logging.show_error_msg("Could not parse Eclim's response. "
-                                       "Are you running Eclim version 1.7.3 or greater?")
-    return None, None
+    return name, os.path.relpath(filename, project_path)
 
 
 def find_project_dir(file_dir):
     ''' tries to find a '.project' file as created by Eclipse to mark
     project folders by traversing the directory tree upward from the given
     directory'''
-    def traverse_upward(look_for, start_at="."):
-        p = os.path.abspath(start_at)
+    file_dir = os.path.abspath(file_dir)
+    if os.path.isfile(file_dir):
+        file_dir = os.path.dirname(file_dir)
+    return project_index.find_root(file_dir)
+
+
+class ProjectIndex(object):
+    '''The registry of Eclipse projects shared by all views and commands.
+
+    It remembers which directories belong to which project root, so that
+    looking up the project of a file does not walk the directory tree each
+    time, and keeps project_list's output keyed by project root and name.
+
+    Directories outside of any project are remembered too. Entries expire
+    after ttl seconds, so that .project files created or deleted behind
+    Subclim's back are noticed eventually. The project list is refreshed
+    in the background once it is older than refresh_interval seconds, and
+    after commands that change projects (see invalidate()). Looking up a
+    project name never waits for eclim.'''
+
+    def __init__(self, ttl=30.0, refresh_interval=60.0):
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self._roots = {}  # directory -> (project root or None, time)
+        self._projects = []  # project_list's entries
+        self._names = {}  # project root -> project name
+        self._paths = {}  # project name -> project root
+        self._fetched = None
+        self._missing = {}  # project root -> time it was looked up in vain
+        self._refreshing = False
+        self._lock = threading.Lock()
 
+    def find_root(self, path):
+        '''Returns the root of the project containing the directory path,
+        None if none does'''
+        now = clock()
+        visited = []
+        root = None
+        # no lock here, the file system may be slow; racing walks of the
+        # same directories come to the same result
         while True:
-            if look_for in os.listdir(p):
-                return p
-            new_p = os.path.abspath(os.path.join(p, ".."))
-            if new_p == p:
-                return None
-            p = new_p
+            entry = self._roots.get(path)
+            if entry is not None and now - entry[1] < self.ttl:
+                root = entry[0]
+                break
+            visited.append(path)
+            if os.path.isfile(os.path.join(path, '.project')):
+                root = path
+                break
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+        for d in visited:
+            self._roots[d] = (root, now)
+        return root
 
-    if os.path.isfile(file_dir):
-        file_dir = os.path.dirname(file_dir)
-    return traverse_upward(".project", start_at=file_dir)
+    def project_name(self, root):
+        '''Name of the Eclipse project at root, None if it is unknown or
+        the project list has not been fetched yet'''
+        self.ensure_fresh(block=False)
+        name = self._names.get(root)
+        if name is None and self._fetched is not None:
+            # the project may have been created since the last refresh,
+            # asking again for the same root is left to the next ttl
+            now = clock()
+            missing = self._missing.get(root)
+            if missing is None or now - missing > self.ttl:
+                self._missing[root] = now
+                self.refresh_async()
+        return name
 
+    def loaded(self):
+        '''True once the project list has been fetched'''
+        return self._fetched is not None
 
-def update_java_src(project, filename):
-    '''Updates Eclipse's status regarding the given file.'''
-    update_cmd = ['-command', 'java_src_update', '-p', project, '-f', filename, '-v']
-    out = call_eclim(update_cmd)
-    return out
+    def project_path(self, name):
+        '''Root of the Eclipse project with the given name, if known'''
+        return self._paths.get(name)
 
+    def projects(self):
+        '''project_list's entries: dicts with 'name' and 'path' (and more)'''
+        self.ensure_fresh()
+        return list(self._projects)
 
-def update_scala_src(project, filename):
-    '''Updates Eclipse's status regarding the given file.'''
-    update_cmd = ['-command', 'scala_src_update', '-p', project, '-f', filename, '-v', '-b']
-    out = call_eclim(update_cmd)
-    return out
+    def ensure_fresh(self, block=True):
+        '''Fetches the project list if there is none yet (in the background
+        unless block is True), or refreshes it in the background if it is
+        too old'''
+        if self._fetched is None and block:
+            self.refresh()
+        elif self._fetched is None or clock() - self._fetched > self.refresh_interval:
+            self.refresh_async()
+
+    def refresh(self):
+        self.update(call_eclim(['-command', 'project_list']))
+
+    def refresh_async(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def done(future):
+            self._refreshing = False
+        submit(self.refresh).add_done_callback(done)
+
+    def update(self, project_list):
+        '''Takes in the output of project_list'''
+        if not project_list:
+            return
+        try:
+            projects = json.loads(project_list)
+        except ValueError:
+            subclim_logging.show_error_msg("Could not parse Eclim's response. "
+                                           "Are you running Eclim version 1.7.3 or greater?")
+            return
+        names = dict((os.path.abspath(p['path']), p['name']) for p in projects)
+        with self._lock:
+            self._projects = projects
+            self._names = names
+            self._paths = dict((name, path) for path, name in names.items())
+            self._fetched = clock()
+
+    def invalidate(self):
+        '''Forgets project roots and refreshes the project list, e.g.
+        after projects were created, moved or deleted'''
+        with self._lock:
+            self._roots.clear()
+            self._missing.clear()
+            if self._fetched is None:
+                return
+        self.refresh_async()
+
+project_index = ProjectIndex()
+
+
+def java_src_update_cmd(project, filename):
+    return ['-command', 'java_src_update', '-p', project, '-f', filename, '-v']
+
+
+def scala_src_update_cmd(project, filename):
+    return ['-command', 'scala_src_update', '-p', project, '-f', filename, '-v', '-b']
+
+
+def update_java_src(project, filename, contents=None):
+    '''Updates Eclipse's status regarding the given file, or regarding
+    contents (bytes) instead of what is saved in it if given.'''
+    return update_src(java_src_update_cmd(project, filename), contents)
+
+
+def update_scala_src(project, filename, contents=None):
+    '''Updates Eclipse's status regarding the given file, or regarding
+    contents (bytes) instead of what is saved in it if given.'''
+    return update_src(scala_src_update_cmd(project, filename), contents)
+
+
+def update_src(update_cmd, contents=None):
+    '''Always runs the update (its output is wanted), but remembers it so
+    that call_eclim_batch can skip the next one if nothing changed.'''
+    if contents is not None:
+        return update_src_overlay(update_cmd, contents)
+    path = src_update_path(update_cmd)
+    if path is None:
+        return call_eclim(update_cmd)
+    # not while an overlay is on the file
+    with subclim_overlay.file_lock(path):
+        key, stamp = src_update_stamp(update_cmd)
+        out = call_eclim(update_cmd)
+        if stamp is not None:
+            _src_updates[key] = (stamp, out)
+        return out
+
+
+def update_src_overlay(update_cmd, contents):
+    opts = dict(zip(update_cmd[2::2], update_cmd[3::2]))
+    return with_overlay(opts['-p'], opts['-f'], contents, lambda: call_eclim(update_cmd),
+                        update_cmd)
+
+
+def with_overlay(project, filename, contents, fn, update_cmd=None):
+    '''Returns fn() called while contents (bytes) are overlaid on the file,
+    see subclim_overlay. The calls fn makes are not coalesced with others
+    nor cached. Afterwards, update_cmd (a *_src_update command) is run
+    again on the restored file, so that Eclipse does not keep the
+    overlaid version.'''
+    project_path = project_index.project_path(project)
+    if project_path is None:
+        raise NotInEclipseProjectException(filename)
+
+    def overlaid():
+        _overlay.active = True
+        try:
+            return fn()
+        finally:
+            _overlay.active = False
+
+    def restored():
+        for command in ('java_src_update', 'scala_src_update'):
+            _src_updates.pop((command, project, filename), None)
+        if update_cmd is None:
+            return
+        # on its own, the overlaid call may have been cancelled
+        call, _current.call = getattr(_current, 'call', None), None
+        try:
+            update_src(update_cmd)
+        except EclimExecutionException as e:
+            log.info('Could not update %s after overlaying it: %s', filename, e)
+        finally:
+            _current.call = call
+    return subclim_overlay.overlay(os.path.join(project_path, filename), contents,
+                                   overlaid, restored)
 
 
 def get_problems(project):
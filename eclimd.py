@@ -0,0 +1,145 @@
+'''
+Launches a headless eclimd and keeps it running, for users who don't want
+to start Eclipse or eclimd by hand. It only depends on the standard
+library; the eclim module configures it through start_eclimd().
+'''
+import os
+import time
+import socket
+import logging
+import threading
+import subprocess
+
+log = logging.getLogger('subclim')
+
+
+def port_open(address, timeout=1.0):
+    '''True if something accepts connections at (host, port)'''
+    try:
+        sock = socket.create_connection(address, timeout)
+    except socket.error:
+        return False
+    sock.close()
+    return True
+
+
+class EclimdSupervisor(object):
+    '''Starts eclimd with the given command line and watches it: once the
+    process is up, ready_check is polled until the server answers, and a
+    crashed server is restarted, waiting exponentially longer after each
+    crash in a row. on_ready is called each time the server becomes ready,
+    or right away if one answers already. stop() shuts down the server
+    again, but only if this supervisor started it.'''
+
+    def __init__(self, command, address, ready_check=None, shutdown=None,
+                 on_ready=None, ready_timeout=120.0, poll_interval=0.5,
+                 min_restart_delay=2.0, max_restart_delay=120.0):
+        self.command = command
+        self.address = address
+        self.ready_check = ready_check or (lambda: port_open(address))
+        self.shutdown = shutdown
+        self.on_ready = on_ready
+        self.ready_timeout = ready_timeout
+        self.poll_interval = poll_interval
+        self.min_restart_delay = min_restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.process = None
+        self.restarts = 0
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+
+    def start(self):
+        '''Launches eclimd and returns right away. Returns False without
+        launching anything if a server answers already.'''
+        if self.ready_check():
+            log.info('eclimd is running already, not starting it')
+            self._ready.set()
+            if self.on_ready is not None:
+                self.on_ready()
+            return False
+        self._stop.clear()
+        self.launch()
+        t = threading.Thread(target=self.watch)
+        t.daemon = True
+        t.start()
+        return True
+
+    def launch(self):
+        log.info('Starting eclimd: %s', self.command)
+        sinfo = None
+        if os.name == 'nt':
+            sinfo = subprocess.STARTUPINFO()
+            sinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+            sinfo.wShowWindow = subprocess.SW_HIDE
+        devnull = open(os.devnull, 'w')
+        try:
+            self.process = subprocess.Popen(
+                self.command, stdin=subprocess.PIPE, stdout=devnull,
+                stderr=devnull, startupinfo=sinfo)
+        finally:
+            devnull.close()
+
+    def is_running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout=None):
+        self._ready.wait(timeout)
+        return self._ready.is_set()
+
+    def watch(self):
+        delay = self.min_restart_delay
+        while not self._stop.is_set():
+            started = time.time()
+            if self.wait_until_ready() and self.on_ready is not None:
+                self.on_ready()
+            code = self.process.wait()
+            self._ready.clear()
+            if self._stop.is_set():
+                return
+            # a server that ran for a while did not crash right at startup
+            if time.time() - started > self.max_restart_delay:
+                delay = self.min_restart_delay
+            log.error('eclimd exited with code %s, restarting it in %.0f seconds', code, delay)
+            if self._stop.wait(delay) or self._stop.is_set():
+                return
+            delay = min(delay * 2, self.max_restart_delay)
+            self.restarts += 1
+            self.launch()
+
+    def wait_until_ready(self):
+        deadline = time.time() + self.ready_timeout
+        while self.is_running() and not self._stop.is_set():
+            if self.ready_check():
+                log.info('eclimd is ready')
+                self._ready.set()
+                return True
+            if time.time() > deadline:
+                log.error('eclimd did not become ready within %.0f seconds', self.ready_timeout)
+                return False
+            self._stop.wait(self.poll_interval)
+        return False
+
+    def stop(self, timeout=10.0):
+        '''Shuts down the server if it was started here, asking it nicely
+        first and killing it if it does not exit within timeout seconds.'''
+        self._stop.set()
+        self._ready.clear()
+        if not self.is_running():
+            return
+        log.info('Stopping eclimd')
+        if self.shutdown is not None:
+            try:
+                self.shutdown()
+            except Exception as e:
+                log.info('eclimd shutdown command failed: %s', e)
+        deadline = time.time() + timeout
+        while self.is_running() and time.time() < deadline:
+            time.sleep(0.1)
+        if self.is_running():
+            self.process.terminate()
+            time.sleep(0.5)
+        if self.is_running():
+            self.process.kill()
@@ -0,0 +1,271 @@
+'''
+A small client for the Nailgun protocol that eclimd speaks. It lets the eclim
+module send commands straight to the server's TCP port instead of spawning
+the "eclim" script (which in turn starts the "ng" client) for every call.
+
+It only depends on the standard library, so it can be used (and
+benchmarked) outside of Sublime Text.
+'''
+import os
+import time
+import select
+import socket
+import struct
+import threading
+
+# default port of eclimd's nailgun server
+DEFAULT_PORT = 9091
+# the class eclim's "ng" client invokes on the server
+ECLIM_MAIN = 'org.eclim.command.Main'
+
+# chunk types, see com.martiansoftware.nailgun.NGConstants
+CHUNK_ARGUMENT = b'A'
+CHUNK_ENVIRONMENT = b'E'
+CHUNK_WORKING_DIR = b'D'
+CHUNK_COMMAND = b'C'
+CHUNK_STDIN = b'0'
+CHUNK_STDIN_EOF = b'.'
+CHUNK_STDOUT = b'1'
+CHUNK_STDERR = b'2'
+CHUNK_EXIT = b'X'
+CHUNK_START_INPUT = b'S'
+
+# every chunk starts with its payload length and its type
+HEADER = struct.Struct('>Ic')
+
+
+class NailgunError(Exception):
+    '''The server violated the protocol or dropped the connection.'''
+    pass
+
+
+class NailgunConnectionError(NailgunError):
+    '''The server could not be reached at all.'''
+    pass
+
+
+def encode_chunk(chunk_type, payload=b''):
+    if not isinstance(payload, bytes):
+        payload = payload.encode('utf-8')
+    return HEADER.pack(len(payload), chunk_type) + payload
+
+
+def encode_request(command, args, cwd=None, env=None):
+    '''Builds the bytes that start a nail: arguments, environment, working
+    directory and finally the command itself.'''
+    return encode_arguments(args) + encode_preamble(command, cwd, env)
+
+
+def encode_arguments(args):
+    return b''.join(encode_chunk(CHUNK_ARGUMENT, a) for a in args)
+
+
+def encode_preamble(command, cwd=None, env=None):
+    '''The part of a request that follows the arguments. It does not depend
+    on the arguments, so it can be encoded once and reused.'''
+    chunks = [encode_chunk(CHUNK_ENVIRONMENT, "%s=%s" % (k, v))
+              for k, v in sorted((env or {}).items())]
+    chunks.append(encode_chunk(CHUNK_WORKING_DIR, cwd or os.getcwd()))
+    chunks.append(encode_chunk(CHUNK_COMMAND, command))
+    return b''.join(chunks)
+
+
+def default_environment():
+    '''The environment the C "ng" client sends along with each command.'''
+    env = dict(os.environ)
+    env['NAILGUN_FILESEPARATOR'] = os.sep
+    env['NAILGUN_PATHSEPARATOR'] = os.pathsep
+    return env
+
+
+def recv_exactly(sock, n):
+    buf = b''
+    while len(buf) < n:
+        data = sock.recv(n - len(buf))
+        if not data:
+            raise NailgunError('Connection closed by the Nailgun server')
+        buf += data
+    return buf
+
+
+def read_response(sock):
+    '''Reads chunks until the server sends the exit code.
+    Returns (exit_code, stdout, stderr) with stdout/stderr as bytes.'''
+    out = []
+    err = []
+    while True:
+        length, chunk_type = HEADER.unpack(recv_exactly(sock, HEADER.size))
+        payload = recv_exactly(sock, length) if length else b''
+        if chunk_type == CHUNK_STDOUT:
+            out.append(payload)
+        elif chunk_type == CHUNK_STDERR:
+            err.append(payload)
+        elif chunk_type == CHUNK_START_INPUT:
+            # eclim never reads stdin, behave like a closed pipe
+            sock.sendall(encode_chunk(CHUNK_STDIN_EOF))
+        elif chunk_type == CHUNK_EXIT:
+            try:
+                exit_code = int(payload.strip() or 0)
+            except ValueError:
+                raise NailgunError('Invalid exit code: %r' % payload)
+            return exit_code, b''.join(out), b''.join(err)
+        else:
+            raise NailgunError('Unexpected chunk type: %r' % chunk_type)
+
+
+class NailgunClient(object):
+    '''Runs commands on a Nailgun server. The server closes the connection
+    after every command, so each call uses a fresh socket.'''
+
+    def __init__(self, host='localhost', port=DEFAULT_PORT, timeout=None,
+                 command=ECLIM_MAIN):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.command = command
+
+    def connect(self):
+        try:
+            return socket.create_connection((self.host, self.port), self.timeout)
+        except socket.error as e:
+            raise NailgunConnectionError(
+                'Could not connect to %s:%s: %s' % (self.host, self.port, e))
+
+    def run(self, args, cwd=None, env=None):
+        '''Runs the command with the given arguments and returns
+        (exit_code, stdout, stderr).'''
+        if env is None:
+            env = default_environment()
+        request = encode_request(self.command, args, cwd, env)
+        sock = self.connect()
+        try:
+            try:
+                sock.sendall(request)
+                return read_response(sock)
+            except socket.error as e:
+                raise NailgunError('Nailgun connection failed: %s' % e)
+        finally:
+            sock.close()
+
+
+def abort(sock):
+    '''Stops a command running on the given connection from another
+    thread; the blocked reader sees the connection as closed.'''
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except socket.error:
+        pass
+
+
+def is_alive(sock):
+    '''Checks an idle connection without blocking. The server never sends
+    anything before it got a command, so a readable socket means it has
+    been closed (e.g. because Eclipse was restarted).'''
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (socket.error, ValueError, select.error):
+        return False
+    return not readable
+
+
+class NailgunPool(object):
+    '''Keeps a few connections to a Nailgun server open ahead of time and
+    shares them between threads.
+
+    Nailgun runs exactly one command per connection, so connections are not
+    given back after use. Instead the pool opens replacements in the
+    background, which takes the connection setup off the caller's path.
+    Idle connections are checked before use and dropped after max_idle
+    seconds; if a pooled connection turns out to be dead, the command is
+    retried once on a fresh one, unless the caller aborted it.'''
+
+    def __init__(self, host='localhost', port=DEFAULT_PORT, size=2,
+                 max_idle=60.0, timeout=None, command=ECLIM_MAIN):
+        self.client = NailgunClient(host, port, timeout, command)
+        self.size = size
+        self.max_idle = max_idle
+        self.preamble = encode_preamble(command, None, default_environment())
+        self._idle = []  # (socket, time it was opened)
+        self._lock = threading.Lock()
+        self._filling = False
+
+    def acquire(self):
+        '''Returns (socket, pooled): a live idle connection if there is one,
+        a new one otherwise. Starts topping up the pool in the background.'''
+        now = time.time()
+        sock = None
+        with self._lock:
+            while self._idle:
+                candidate, opened = self._idle.pop()
+                if now - opened <= self.max_idle and is_alive(candidate):
+                    sock = candidate
+                    break
+                candidate.close()
+        self.fill_async()
+        if sock is not None:
+            return sock, True
+        return self.client.connect(), False
+
+    def fill(self):
+        '''Opens connections until the pool holds size idle ones.'''
+        try:
+            while True:
+                with self._lock:
+                    if len(self._idle) >= self.size:
+                        return
+                sock = self.client.connect()
+                with self._lock:
+                    self._idle.append((sock, time.time()))
+        except NailgunConnectionError:
+            # server is gone, the next acquire will find out
+            pass
+        finally:
+            with self._lock:
+                self._filling = False
+
+    def fill_async(self):
+        with self._lock:
+            if self._filling or len(self._idle) >= self.size:
+                return
+            self._filling = True
+        t = threading.Thread(target=self.fill)
+        t.daemon = True
+        t.start()
+
+    def run(self, args, register=None, aborted=None):
+        '''Runs the command with the given arguments and returns
+        (exit_code, stdout, stderr). register(socket) is called with each
+        connection used, so that the caller can abort() it; aborted()
+        tells whether it did, which looks like a dead connection here.'''
+        request = encode_arguments(args) + self.preamble
+        sock, pooled = self.acquire()
+        try:
+            try:
+                if register is not None:
+                    register(sock)
+                sock.sendall(request)
+                # a connection that died while idle fails right here,
+                # before the server could have run anything
+                if pooled and not sock.recv(1, socket.MSG_PEEK):
+                    raise socket.error('connection closed while idle')
+            except socket.error:
+                if not pooled or (aborted is not None and aborted()):
+                    raise
+                sock.close()
+                self.close()
+                sock = self.client.connect()
+                if register is not None:
+                    register(sock)
+                sock.sendall(request)
+            return read_response(sock)
+        except socket.error as e:
+            raise NailgunError('Nailgun connection failed: %s' % e)
+        finally:
+            sock.close()
+
+    def close(self):
+        '''Closes all idle connections.'''
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for sock, _ in idle:
+            sock.close()
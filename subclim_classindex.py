@@ -0,0 +1,151 @@
+'''
+Indexes the classes on a project's classpath by simple name, so that
+import candidates can be listed without asking eclim. Jars are read from
+their central directory only, source and class folders by file name. The
+index is persisted as JSON. Independent of the Sublime Text API.
+'''
+import os
+import json
+import time
+import logging
+import zipfile
+
+log = logging.getLogger('subclim')
+
+
+def entry_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime, st.st_size]
+
+
+def class_name(relative_path):
+    '''"java/util/Map$Entry.class" -> ("java.util", "Map.Entry"), None for
+    anonymous and local classes and for module-info and package-info'''
+    base, _, extension = relative_path.rpartition('.')
+    if extension not in ('class', 'java'):
+        return None
+    package, _, name = base.replace('\\', '/').rpartition('/')
+    parts = name.split('$')
+    if name.endswith('-info') or any(not p or p[0].isdigit() for p in parts):
+        return None
+    return package.replace('/', '.'), '.'.join(parts)
+
+
+def add_class(classes, relative_path):
+    found = class_name(relative_path)
+    if found is not None:
+        classes.setdefault(found[0], []).append(found[1])
+
+
+def scan_jar(path):
+    '''{package: [class names]} of a jar, from its central directory'''
+    classes = {}
+    zf = zipfile.ZipFile(path)
+    try:
+        for name in zf.namelist():
+            add_class(classes, name)
+    finally:
+        zf.close()
+    return classes
+
+
+def scan_directory(path):
+    '''{package: [class names]} of a source or class folder'''
+    classes = {}
+    for root, dirs, files in os.walk(path):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        relative = os.path.relpath(root, path)
+        for f in files:
+            add_class(classes, f if relative == '.' else os.path.join(relative, f))
+    return classes
+
+
+class ClassIndex(object):
+    '''Fully qualified class names by simple name, built from classpath
+    entries (jars, source and class folders). On a rebuild, jars are only
+    read again if their modification time or size changed; folders are
+    always scanned, so the index is considered stale after max_age
+    seconds.'''
+
+    version = 1
+
+    def __init__(self, path=None, max_age=600):
+        self.path = path
+        self.max_age = max_age
+        self.built = 0
+        # classpath entry -> [mtime, size, {package: [class names]}]
+        self.entries = {}
+        # simple name -> [fully qualified names]
+        self.names = {}
+
+    def build(self, paths):
+        entries = {}
+        for path in paths:
+            stamp = entry_stamp(path)
+            if stamp is None:
+                continue
+            is_dir = os.path.isdir(path)
+            old = self.entries.get(path)
+            if old is not None and old[:2] == stamp and not is_dir:
+                entries[path] = old
+                continue
+            try:
+                classes = scan_directory(path) if is_dir else scan_jar(path)
+            except (IOError, OSError, zipfile.BadZipfile) as e:
+                log.info('Could not index %s: %s', path, e)
+                continue
+            entries[path] = stamp + [classes]
+        self.entries = entries
+        self.built = time.time()
+        self.update_names()
+
+    def update_names(self):
+        names = {}
+        for _, _, classes in self.entries.values():
+            for package, class_names in classes.items():
+                for name in class_names:
+                    fqn = package + '.' + name if package else name
+                    names.setdefault(name.rpartition('.')[2], set()).add(fqn)
+        self.names = dict((name, sorted(fqns)) for name, fqns in names.items())
+
+    def lookup(self, simple_name):
+        return self.names.get(simple_name, [])
+
+    def has_jre(self):
+        '''True if the JRE's classes are indexed, which needs a runtime jar
+        on the classpath (there is none since Java 9)'''
+        return 'java.lang.Object' in self.lookup('Object')
+
+    def is_stale(self):
+        if time.time() - self.built > self.max_age:
+            return True
+        return any(entry[:2] != entry_stamp(path)
+                   for path, entry in self.entries.items() if not os.path.isdir(path))
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'version': self.version, 'built': self.built,
+                       'entries': self.entries}, f, separators=(',', ':'))
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(tmp, self.path)
+
+    @classmethod
+    def load(cls, path, max_age=600):
+        '''The index saved at path, None if there is none or it can't be read'''
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if data.get('version') != cls.version:
+            return None
+        index = cls(path, max_age)
+        index.built = data['built']
+        index.entries = data['entries']
+        index.update_names()
+        return index
@@ -0,0 +1,138 @@
+'''
+Decodes eclim's completion output and works on completion lists in the
+(display, insert) form Sublime takes. Independent of the Sublime Text API.
+'''
+import re
+import json
+import heapq
+
+# separates the variants of an overloaded method in a proposal's info
+OVERLOAD_SEPARATOR = '<br/>'
+PARAMETER_LIST = re.compile(r'\((.*)\)')
+IDENTIFIER = re.compile(r'\w+', re.UNICODE)
+
+# kinds of proposals, in the order they are ranked
+FIELD = 0
+METHOD = 1
+TYPE = 2
+
+
+def decode(eclim_output):
+    '''Turns the output of java_complete or scala_complete into a list of
+    (display, insert) tuples, one per variant of overloaded methods. Their
+    parameters become snippet fields.'''
+    completions = json.loads(eclim_output)
+    # newer versions of Eclim package the list of completions in a dict
+    if isinstance(completions, dict):
+        completions = completions['completions']
+    result = []
+    append = result.append
+    search = PARAMETER_LIST.search
+    # parameter list -> snippet fields, overloads often share them
+    snippets = {}
+    for c in completions:
+        info = c['info']
+        completion = c['completion']
+        if OVERLOAD_SEPARATOR not in info:
+            name, _, rest = info.partition(' ')
+            append((name + '\t' + rest, completion or info))
+            continue
+        for variant in info.split(OVERLOAD_SEPARATOR):
+            match = search(variant)
+            if match is None:
+                continue
+            params = match.group(1)
+            if params:
+                fields = snippets.get(params)
+                if fields is None:
+                    fields = snippets[params] = ', '.join([
+                        '${%i:%s}' % (i, param.rpartition(' ')[2])
+                        for i, param in enumerate(params.split(', '), 1)]) + ')'
+                insert = completion + fields
+            else:
+                insert = completion
+            name, _, rest = variant.partition(' ')
+            append((name + '\t' + rest, insert))
+    return result
+
+
+def completion_name(completion):
+    return completion[0].split('\t', 1)[0]
+
+
+def narrow(completions, prefix):
+    '''The completions whose name starts with prefix, ignoring case,
+    followed by those containing the characters of prefix in order'''
+    if not prefix:
+        return completions
+    lower = prefix.lower()
+    fuzzy = re.compile('.*?'.join(re.escape(c) for c in prefix), re.IGNORECASE)
+    starting, containing = [], []
+    for c in completions:
+        name = completion_name(c)
+        if name.lower().startswith(lower):
+            starting.append(c)
+        elif fuzzy.search(name):
+            containing.append(c)
+    return starting + containing
+
+
+def identifier(name):
+    '''"getName()" -> "getName"'''
+    match = IDENTIFIER.match(name)
+    return match.group(0) if match else name
+
+
+def kind(name):
+    if '(' in name:
+        return METHOD
+    if name[:1].isupper():
+        return TYPE
+    return FIELD
+
+
+def rank(completions, prefix, counts=None, limit=None):
+    '''The completions matching prefix, best first, at most limit of them.
+    They are ordered by how well they match (same case prefix, any case
+    prefix, fuzzy), how often they were accepted before according to
+    counts (identifier -> number), their kind and their name.'''
+    counts = counts or {}
+    lower = prefix.lower()
+
+    def key(c):
+        name = completion_name(c)
+        if name.startswith(prefix):
+            tier = 0
+        elif name.lower().startswith(lower):
+            tier = 1
+        else:
+            tier = 2
+        return (tier, -counts.get(identifier(name), 0), kind(name), name.lower())
+
+    matches = narrow(completions, prefix)
+    if limit and len(matches) > limit:
+        return heapq.nsmallest(limit, matches, key=key)
+    return sorted(matches, key=key)
+
+
+class AcceptanceCounts(object):
+    '''How often completions were accepted, per project. When a project
+    has more than max_names entries, all its counts are halved and those
+    reaching zero are dropped, so that recent acceptances weigh more.'''
+
+    def __init__(self, max_names=500):
+        self.max_names = max_names
+        self.tables = {}
+
+    def record(self, project, name):
+        table = self.tables.setdefault(project, {})
+        table[name] = table.get(name, 0) + 1
+        if len(table) > self.max_names:
+            for n, count in list(table.items()):
+                if count // 2:
+                    table[n] = count // 2
+                else:
+                    del table[n]
+
+    def counts(self, project):
+        return self.tables.get(project, {})
@@ -0,0 +1,321 @@
+'''
+Indexes the public and protected members of the classes in jars by
+reading their class files (constant pool, fields and methods), so that
+completions on library types can be answered without eclim. There is one
+index file per jar, sorted by class name and memory-mapped for lookups.
+Independent of the Sublime Text API.
+'''
+import os
+import mmap
+import struct
+import logging
+import zipfile
+
+log = logging.getLogger('subclim')
+
+ACC_PUBLIC = 0x0001
+ACC_PROTECTED = 0x0004
+ACC_STATIC = 0x0008
+ACC_BRIDGE = 0x0040
+ACC_SYNTHETIC = 0x1000
+# the access flags kept in the index
+MEMBER_FLAGS = ACC_PUBLIC | ACC_PROTECTED | ACC_STATIC
+
+PRIMITIVES = {
+    'B': 'byte', 'C': 'char', 'D': 'double', 'F': 'float', 'I': 'int',
+    'J': 'long', 'S': 'short', 'Z': 'boolean', 'V': 'void',
+}
+
+MAGIC = b'SCMI'
+VERSION = 2
+# magic, version, jar mtime, jar size, number of classes
+HEADER = struct.Struct('>4sHdQI')
+# offsets of a class name and of its record
+SLOT = struct.Struct('>II')
+
+
+class ClassFileError(Exception):
+    pass
+
+
+def internal_to_fqn(name):
+    '''"java/util/Map$Entry" -> "java.util.Map.Entry"'''
+    return name.replace('/', '.').replace('$', '.')
+
+
+def parse_class(data):
+    '''Returns (access flags, name, super class name, interface names,
+    members) of a class file. Names are in internal form (java/util/List),
+    members are (kind 'f' or 'm', access flags, name, descriptor) of the public
+    and protected fields and methods, constructors left out.'''
+    if data[:4] != b'\xca\xfe\xba\xbe':
+        raise ClassFileError('Not a class file')
+    unpack = struct.unpack_from
+    count = unpack('>H', data, 8)[0]
+    pos = 10
+    utf8 = {}
+    classes = {}
+    i = 1
+    try:
+        while i < count:
+            tag = bytearray(data[pos:pos + 1])[0]
+            if tag == 1:
+                length = unpack('>H', data, pos + 1)[0]
+                utf8[i] = data[pos + 3:pos + 3 + length].decode('utf-8', 'replace')
+                pos += 3 + length
+            elif tag == 7:
+                classes[i] = unpack('>H', data, pos + 1)[0]
+                pos += 3
+            elif tag in (8, 16, 19, 20):
+                pos += 3
+            elif tag == 15:
+                pos += 4
+            elif tag in (3, 4, 9, 10, 11, 12, 17, 18):
+                pos += 5
+            elif tag in (5, 6):
+                # takes two entries
+                pos += 9
+                i += 1
+            else:
+                raise ClassFileError('Unknown constant pool tag %d' % tag)
+            i += 1
+
+        def class_at(index):
+            return utf8[classes[index]] if index else ''
+
+        access, this_class, super_class, n_interfaces = unpack('>HHHH', data, pos)
+        pos += 8
+        interfaces = [class_at(unpack('>H', data, pos + 2 * k)[0]) for k in range(n_interfaces)]
+        pos += 2 * n_interfaces
+        members = []
+        for kind in ('f', 'm'):
+            n = unpack('>H', data, pos)[0]
+            pos += 2
+            for _ in range(n):
+                flags, name_index, descriptor_index, n_attributes = unpack('>HHHH', data, pos)
+                pos += 8
+                for _ in range(n_attributes):
+                    pos += 6 + unpack('>I', data, pos + 2)[0]
+                name = utf8[name_index]
+                if flags & (ACC_PUBLIC | ACC_PROTECTED) and \
+                        not flags & (ACC_SYNTHETIC | ACC_BRIDGE) and not name.startswith('<'):
+                    members.append((kind, flags & MEMBER_FLAGS, name, utf8[descriptor_index]))
+        return access, class_at(this_class), class_at(super_class), interfaces, members
+    except (KeyError, IndexError, struct.error) as e:
+        raise ClassFileError('Malformed class file: %r' % e)
+
+
+def parse_type(descriptor, pos):
+    '''Returns (simple type name, position after it) of the field type at
+    pos in a descriptor'''
+    dimensions = 0
+    while descriptor[pos] == '[':
+        dimensions += 1
+        pos += 1
+    if descriptor[pos] == 'L':
+        end = descriptor.index(';', pos)
+        name = descriptor[pos + 1:end].rpartition('/')[2].replace('$', '.')
+        pos = end + 1
+    else:
+        name = PRIMITIVES[descriptor[pos]]
+        pos += 1
+    return name + '[]' * dimensions, pos
+
+
+def method_signature(descriptor):
+    '''"(ILjava/lang/String;)[J" -> (["int", "String"], "long[]")'''
+    params = []
+    pos = 1
+    while descriptor[pos] != ')':
+        param, pos = parse_type(descriptor, pos)
+        params.append(param)
+    return params, parse_type(descriptor, pos + 1)[0]
+
+
+def encode_record(super_class, interfaces, members):
+    lines = [super_class, ' '.join(interfaces)]
+    lines.extend('%s %d %s %s' % (kind, flags, name, descriptor)
+                 for kind, flags, name, descriptor in members)
+    return '\n'.join(lines).encode('utf-8')
+
+
+def decode_record(data):
+    '''Returns (super class, interfaces, members) as stored by build()'''
+    lines = data.decode('utf-8').split('\n')
+    members = []
+    for line in lines[2:]:
+        kind, flags, name, descriptor = line.split(' ')
+        members.append((kind, int(flags), name, descriptor))
+    return lines[0], lines[1].split(), members
+
+
+def build(jar, path):
+    '''Writes the member index of a jar to path'''
+    st = os.stat(jar)
+    records = {}
+    zf = zipfile.ZipFile(jar)
+    try:
+        for name in zf.namelist():
+            if not name.endswith('.class') or name.endswith('-info.class'):
+                continue
+            try:
+                access, this_class, super_class, interfaces, members = parse_class(zf.read(name))
+            except ClassFileError as e:
+                log.info('Skipping %s in %s: %s', name, jar, e)
+                continue
+            if access & ACC_PUBLIC:
+                records[internal_to_fqn(this_class).encode('utf-8')] = \
+                    encode_record(super_class, interfaces, members)
+    finally:
+        zf.close()
+
+    names = sorted(records)
+    offset = HEADER.size + SLOT.size * len(names)
+    slots = []
+    data = []
+    for name in names:
+        record = records[name]
+        slots.append(SLOT.pack(offset, offset + 2 + len(name)))
+        data.append(struct.pack('>H', len(name)) + name + struct.pack('>I', len(record)) + record)
+        offset += 6 + len(name) + len(record)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, st.st_mtime, st.st_size, len(names)))
+        f.write(b''.join(slots))
+        f.write(b''.join(data))
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp, path)
+    return len(names)
+
+
+def is_current(jar, path):
+    '''True if path holds the member index of the jar as it is now'''
+    try:
+        st = os.stat(jar)
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+        magic, version, mtime, size, _ = HEADER.unpack(header)
+    except (OSError, IOError, struct.error):
+        return False
+    return magic == MAGIC and version == VERSION and mtime == st.st_mtime and size == st.st_size
+
+
+class MemberFile(object):
+    '''A memory-mapped member index file. Looking up a class is a binary
+    search over its sorted names; only the records read are decoded.'''
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.count = HEADER.unpack_from(self.map, 0)[4]
+
+    def name_at(self, i):
+        offset = SLOT.unpack_from(self.map, HEADER.size + SLOT.size * i)[0]
+        length = struct.unpack_from('>H', self.map, offset)[0]
+        return self.map[offset + 2:offset + 2 + length]
+
+    def get(self, fqn):
+        '''(super class, interfaces, members) of a class, None if unknown'''
+        key = fqn.encode('utf-8')
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.name_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == self.count or self.name_at(lo) != key:
+            return None
+        offset = SLOT.unpack_from(self.map, HEADER.size + SLOT.size * lo)[1]
+        length = struct.unpack_from('>I', self.map, offset)[0]
+        return decode_record(self.map[offset + 4:offset + 4 + length])
+
+    def close(self):
+        self.map.close()
+
+
+class MemberIndex(object):
+    '''The member index files of the jars on a classpath'''
+
+    def __init__(self, files):
+        self.files = files
+
+    def get(self, fqn):
+        for f in self.files:
+            record = f.get(fqn)
+            if record is not None:
+                return record
+        return None
+
+    def __contains__(self, fqn):
+        return self.get(fqn) is not None
+
+    def completions(self, fqn, static, protected=False):
+        '''(display, insert) tuples of the members of a class and its super
+        types, only static ones if static is True. Protected members are
+        left out unless protected is True, as they are only accessible on
+        this or super. None if the class is not in the index.'''
+        if self.get(fqn) is None:
+            return None
+        result = []
+        seen = set()
+        # (class, whether it was reached as an implemented interface)
+        queue = [(fqn, False)]
+        visited = set()
+        while queue:
+            owner, interface = queue.pop(0)
+            if owner in visited:
+                continue
+            visited.add(owner)
+            record = self.get(owner)
+            if record is None:
+                continue
+            super_class, interfaces, members = record
+            owner_name = owner.rpartition('.')[2]
+            for kind, flags, name, descriptor in members:
+                is_static = flags & ACC_STATIC
+                if static and not is_static:
+                    continue
+                if not protected and not flags & ACC_PUBLIC:
+                    continue
+                if kind == 'f':
+                    if name in seen:
+                        continue
+                    seen.add(name)
+                    result.append(('%s\t%s - %s' % (name, parse_type(descriptor, 0)[0], owner_name), name))
+                    continue
+                # static interface methods are not inherited
+                if interface and is_static:
+                    continue
+                params, returns = method_signature(descriptor)
+                key = (name, tuple(params))
+                if key in seen:
+                    continue
+                seen.add(key)
+                fields = ', '.join('${%i:%s}' % (i, p) for i, p in enumerate(params, 1))
+                result.append(('%s(%s)\t%s - %s' % (name, ', '.join(params), returns, owner_name),
+                               '%s(%s)' % (name, fields)))
+            if super_class:
+                queue.append((internal_to_fqn(super_class), False))
+            queue.extend((internal_to_fqn(t), True) for t in interfaces)
+        return result
+
+def resolve_type(name, package, imports, known):
+    '''The fully qualified name a simple (or dotted) type name used in a
+    file refers to, given the file's package and imports, if known(fqn)
+    says it is a class. None if it can't be resolved.'''
+    first, _, rest = name.partition('.')
+    if first[:1].islower():
+        return name if known(name) else None
+    for i in imports:
+        if i.rpartition('.')[2] == first:
+            fqn = i + ('.' + rest if rest else '')
+            return fqn if known(fqn) else None
+    candidates = [p + '.' + name for p in
+                  [package, 'java.lang'] + [i[:-2] for i in imports if i.endswith('.*')] if p]
+    for fqn in candidates:
+        if known(fqn):
+            return fqn
+    return None
@@ -0,0 +1,94 @@
+'''
+Maps character positions in a buffer to the UTF-8 byte offsets eclim
+expects, without copying and encoding all the text before the position
+for every lookup. Independent of the Sublime Text API, so that it can be
+benchmarked on its own.
+'''
+import bisect
+
+# runs of characters taking more than one byte in UTF-8 and the number of
+# extra bytes per character, in the regex syntax of Sublime's find_all
+MULTIBYTE_PATTERNS = (
+    (r'[\x{80}-\x{7FF}]+', 1),
+    (r'[\x{800}-\x{FFFF}]+', 2),
+    (r'[\x{10000}-\x{10FFFF}]+', 3),
+)
+
+
+def extra_bytes(text):
+    '''Number of bytes text takes in UTF-8 beyond one per character'''
+    return len(text.encode('utf-8')) - len(text)
+
+
+class ByteOffsetIndex(object):
+    '''The extra UTF-8 bytes of the rows of a text that contain multi-byte
+    characters, sorted by row. Looking up the extra bytes before a row is
+    a binary search over those rows; text without any is the all-ASCII
+    fast path. Replacing rows after an edit only scans the new ones, and
+    the running totals of extra bytes are only brought up to date as far
+    as lookups need them, which mostly happen where the edit was made.'''
+
+    def __init__(self, row_extras):
+        '''row_extras: {row: extra bytes} of the rows with multi-byte
+        characters'''
+        self.rows = sorted(row_extras)
+        self.extras = [row_extras[row] for row in self.rows]
+        # extra bytes of the rows up to and including self.rows[i], valid
+        # for the first self._valid of them only
+        self._sums = []
+        self._valid = 0
+
+    def is_ascii(self):
+        return not self.rows
+
+    def has_extra(self, row):
+        i = bisect.bisect_left(self.rows, row)
+        return i < len(self.rows) and self.rows[i] == row
+
+    def extra_before(self, row):
+        '''Extra bytes of all rows before row'''
+        i = bisect.bisect_left(self.rows, row)
+        if i == 0:
+            return 0
+        sums = self._sums
+        if self._valid < i:
+            del sums[self._valid:]
+            total = sums[-1] if sums else 0
+            for extra in self.extras[self._valid:i]:
+                total += extra
+                sums.append(total)
+            self._valid = i
+        return sums[i - 1]
+
+    def replace_lines(self, first, count, lines):
+        '''Replaces the count rows starting at row first with lines'''
+        start = bisect.bisect_left(self.rows, first)
+        end = bisect.bisect_left(self.rows, first + count)
+        shift = len(lines) - count
+        new_rows = []
+        new_extras = []
+        for i, line in enumerate(lines):
+            extra = extra_bytes(line)
+            if extra:
+                new_rows.append(first + i)
+                new_extras.append(extra)
+        self.rows[start:end] = new_rows
+        self.extras[start:end] = new_extras
+        if shift:
+            after = start + len(new_rows)
+            self.rows[after:] = [row + shift for row in self.rows[after:]]
+        self._valid = min(self._valid, start)
+
+    @classmethod
+    def from_text(cls, text):
+        return cls(dict((row, extra) for row, extra in
+                        enumerate(extra_bytes(line) for line in text.split('\n')) if extra))
+
+    @classmethod
+    def from_view(cls, view):
+        row_extras = {}
+        for pattern, per_char in MULTIBYTE_PATTERNS:
+            for r in view.find_all(pattern):
+                row = view.rowcol(r.begin())[0]
+                row_extras[row] = row_extras.get(row, 0) + r.size() * per_char
+        return cls(row_extras)
@@ -0,0 +1,186 @@
+'''
+Hands the unsaved contents of a buffer to eclim. Eclim only reads sources
+from disk, so the buffer is swapped into the file for the duration of a
+command and the saved contents are put back afterwards, together with the
+file's modification time. Independent of the Sublime Text API.
+'''
+import os
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+
+log = logging.getLogger('subclim')
+
+# the saved contents, a digest of the overlaid ones and the path of the file
+BACKUP_SUFFIXES = ('.orig', '.overlay', '.path')
+
+# copies of the saved contents of overlaid files, until they are restored
+overlay_dir = os.path.join(tempfile.gettempdir(), 'subclim-overlay')
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+# path -> number of saves announced by note_save(); an overlay whose file
+# was saved meanwhile leaves it alone
+_saves = {}
+# path -> time of the note_save() of a save that hasn't finished yet, see
+# note_saved(); no overlay is started meanwhile
+_saving = {}
+_saves_lock = threading.Lock()
+
+# seconds after which a save that never reported back is not waited for
+SAVE_TIMEOUT = 10.0
+
+
+def file_lock(path):
+    '''The lock held while path is overlaid. Also to be held by anything
+    that reads path for eclim, so that it does not see an overlay that
+    isn't its own.'''
+    with _locks_lock:
+        lock = _locks.get(path)
+        if lock is None:
+            lock = _locks[path] = threading.RLock()
+        return lock
+
+
+def note_save(path):
+    '''To be called before path is saved by the editor. Does not wait for
+    an overlay of path to end, only for its restore to finish.'''
+    key = save_key(path)
+    with _saves_lock:
+        _saves[key] = _saves.get(key, 0) + 1
+        _saving[key] = time.time()
+
+
+def note_saved(path):
+    '''To be called once the editor saved path'''
+    with _saves_lock:
+        _saving.pop(save_key(path), None)
+
+
+def saving(key):
+    started = _saving.get(key)
+    return started is not None and time.time() - started < SAVE_TIMEOUT
+
+
+def save_key(path):
+    # the editor and eclim may name the same file differently
+    return os.path.normcase(os.path.realpath(path))
+
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def write_file(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def backup_path(path):
+    return os.path.join(overlay_dir, hashlib.sha1(path.encode('utf-8')).hexdigest())
+
+
+def digest(data):
+    return hashlib.sha1(data).hexdigest().encode('ascii')
+
+
+def remove_backup(backup):
+    for suffix in BACKUP_SUFFIXES:
+        try:
+            os.remove(backup + suffix)
+        except OSError:
+            pass
+
+
+def set_mtime(path, st):
+    '''Gives path the access and modification times of the stat result st,
+    to the nanosecond where possible, so editors don't see it as changed.'''
+    if hasattr(st, 'st_mtime_ns'):
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    else:
+        os.utime(path, (st.st_atime, st.st_mtime))
+
+
+def overlay(path, contents, fn, after=None):
+    '''Calls fn() while the file at path holds contents (bytes) instead of
+    what is saved there and returns its result. Returns fn() right away if
+    nothing differs, or while the editor is saving the file (see
+    note_save). after() is called once the saved contents are back, still
+    holding the file lock.
+
+    The saved contents are copied to overlay_dir first, so that they can be
+    restored by recover() should Sublime die in between. If the file is
+    saved for real while overlaid or no longer holds contents afterwards,
+    it is left as it is.'''
+    with file_lock(path):
+        key = save_key(path)
+        # a save starting now waits until the overlay is in place, and
+        # the restore then sees it
+        with _saves_lock:
+            saved = read_file(path)
+            if saved == contents or saving(key):
+                saves = None
+            else:
+                saved_stat = os.stat(path)
+                saves = _saves.get(key, 0)
+                backup = backup_path(path)
+                if not os.path.isdir(overlay_dir):
+                    os.makedirs(overlay_dir)
+                write_file(backup + '.orig', saved)
+                write_file(backup + '.overlay', digest(contents))
+                # last, recover() only looks at backups with a path
+                write_file(backup + '.path', path.encode('utf-8'))
+                write_file(path, contents)
+        if saves is None:
+            return fn()
+        try:
+            return fn()
+        finally:
+            restore(path, saved, saved_stat, contents, saves, backup)
+            if after is not None:
+                after()
+
+
+def restore(path, saved, saved_stat, contents, saves, backup):
+    with _saves_lock:
+        try:
+            overlaid = _saves.get(save_key(path), 0) == saves and read_file(path) == contents
+        except (IOError, OSError):
+            overlaid = False
+        if overlaid:
+            write_file(path, saved)
+            set_mtime(path, saved_stat)
+        else:
+            log.info('%s changed while overlaid, not restoring it', path)
+    remove_backup(backup)
+
+
+def recover():
+    '''Restores the saved contents of files that were still overlaid when
+    Sublime exited, unless they have been changed since. Returns the paths
+    of the restored files.'''
+    if not os.path.isdir(overlay_dir):
+        return []
+    restored = []
+    for name in os.listdir(overlay_dir):
+        if not name.endswith('.path'):
+            continue
+        backup = os.path.join(overlay_dir, name[:-len('.path')])
+        try:
+            path = read_file(backup + '.path').decode('utf-8')
+            with file_lock(path):
+                if digest(read_file(path)) == read_file(backup + '.overlay'):
+                    write_file(path, read_file(backup + '.orig'))
+                    restored.append(path)
+                    log.info('Restored %s after an interrupted overlay', path)
+                else:
+                    log.info('%s changed after an interrupted overlay, not restoring it', path)
+        except (IOError, OSError) as e:
+            log.error('Could not restore overlaid file from %s: %s', backup, e)
+            continue
+        remove_backup(backup)
+    return restored
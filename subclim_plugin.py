@@ -5,18 +5,32 @@ import sublime
 import re
 import os
 import json
-import threading
+import atexit
+import hashlib
+import zipfile
 
 try:
     # Python 3
     from . import eclim
     from . import subclim_logging
-    import queue
+    from . import subclim_tasks
+    from . import subclim_overlay
+    from . import subclim_completion
+    from . import subclim_symbols
+    from . import subclim_classindex
+    from . import subclim_memberindex
+    from .subclim_offsets import ByteOffsetIndex, extra_bytes
 except (ValueError):
     # Python 2
     import eclim
     import subclim_logging
-    import Queue as queue
+    import subclim_tasks
+    import subclim_overlay
+    import subclim_completion
+    import subclim_symbols
+    import subclim_classindex
+    import subclim_memberindex
+    from subclim_offsets import ByteOffsetIndex, extra_bytes
 
 log = subclim_logging.getLogger('subclim')
 settings = sublime.load_settings("Subclim.sublime-settings")
@@ -31,28 +45,127 @@ settings.add_on_change("subclim_auto_complete", auto_complete_changed)
 
 def offset_of_location(view, location):
     '''we should get utf-8 size in bytes for eclim offset'''
-    text = view.substr(sublime.Region(0, location))
-    cr_size = 0
+    row, col = view.rowcol(location)
+    index = ByteOffsets.index(view)
+    offset = location + index.extra_before(row)
+    if index.has_extra(row):
+        offset += extra_bytes(view.substr(sublime.Region(location - col, location)))
     if view.line_endings() == 'Windows':
-        cr_size = text.count('\n')
-    return len(text.encode('utf-8')) + cr_size
+        offset += row
+    return offset
 
 
-# worker thread for async tasks
-def worker():
-    while True:
-        task = tasks.get()
+# commands whose edits only change the rows around the selections
+typing_commands = ('insert', 'left_delete', 'right_delete', 'delete_word', 'paste',
+                   'cut', 'insert_snippet', 'commit_completion', 'insert_best_completion')
+
+
+def row_count(view):
+    return view.rowcol(view.size())[0] + 1
+
+
+def edit_rows(view):
+    '''The first and last row an edit at the selections can change'''
+    regions = view.sel()
+    if len(regions) == 0:
+        return None
+    return (view.rowcol(max(regions[0].begin() - 1, 0))[0],
+            view.rowcol(min(regions[-1].end() + 1, view.size()))[0])
+
+
+def replaced_rows(view, entry):
+    '''What the last modification of view did to its rows, given entry =
+    [change count, number of rows, ..., edit_rows()] as of the change
+    before: (first row, number of rows replaced, rows replacing them). None
+    unless it was made with one of typing_commands, e.g. for undo.'''
+    if entry[0] != view.change_count() - 1 or entry[3] is None or \
+            view.command_history(0)[0] not in typing_commands or \
+            view.command_history(1)[0]:  # undo
+        return None
+    first, last = entry[3]
+    rows = row_count(view)
+    if last + rows - entry[1] < first:
+        return None
+    region = sublime.Region(view.text_point(first, 0),
+                            view.line(view.text_point(last + rows - entry[1], 0)).end())
+    return first, last - first + 1, view.substr(region).split('\n')
+
+
+def update_rows(view, entry):
+    '''Replaces the rows the last modification changed in entry[2], an
+    index with a replace_lines method, see replaced_rows. Returns False if
+    it could not tell them.'''
+    replaced = replaced_rows(view, entry)
+    if replaced is None:
+        return False
+    entry[2].replace_lines(*replaced)
+    entry[0], entry[1], entry[3] = view.change_count(), row_count(view), edit_rows(view)
+    return True
+
+
+class ByteOffsets(sublime_plugin.EventListener):
+    '''Keeps a ByteOffsetIndex per view for offset_of_location. Typing
+    only rescans the rows around the selections; after other modifications
+    the next lookup rebuilds it.'''
+    # view id -> [change count, number of rows, ByteOffsetIndex, edit_rows()]
+    indexes = {}
+
+    @classmethod
+    def index(cls, view):
+        entry = cls.indexes.get(view.id())
+        if entry is None or entry[0] != view.change_count():
+            entry = [view.change_count(), row_count(view), ByteOffsetIndex.from_view(view),
+                     edit_rows(view)]
+            cls.indexes[view.id()] = entry
+        return entry[2]
+
+    def on_modified(self, view):
+        entry = ByteOffsets.indexes.get(view.id())
+        if entry is not None:
+            update_rows(view, entry)
+
+    def on_selection_modified(self, view):
+        entry = ByteOffsets.indexes.get(view.id())
+        if entry is not None and entry[0] == view.change_count():
+            entry[3] = edit_rows(view)
+
+    def on_close(self, view):
+        ByteOffsets.indexes.pop(view.id(), None)
+
+
+def buffer_contents(view):
+    '''The text of view as it would be saved, for eclim commands on unsaved
+    buffers. None for encodings other than UTF-8.'''
+    if view.encoding() not in ('UTF-8', 'Undefined'):
+        return None
+    text = view.substr(sublime.Region(0, view.size()))
+    if view.line_endings() == 'Windows':
+        text = text.replace('\n', '\r\n')
+    return text.encode('utf-8')
+
+
+def when_done(future, callback):
+    '''Calls callback with the result of an eclim future on the main thread.
+    Failed calls have been logged by the eclim module already, cancelled
+    ones are dropped silently.'''
+    def done(f):
         try:
-            task()
-        except:
-            import traceback
-            traceback.print_exc()
-        finally:
-            tasks.task_done()
-tasks = queue.Queue()
-t = threading.Thread(target=worker)
-t.daemon = True
-t.start()
+            result = f.result()
+        except eclim.EclimCancelledException:
+            return
+        except eclim.EclimTimeoutException as e:
+            log.error(str(e))
+            return
+        except eclim.EclimExecutionException:
+            return
+        sublime.set_timeout(lambda: callback(result), 0)
+    future.add_done_callback(done)
+
+
+# worker threads for async tasks, see subclim_tasks for the priorities
+tasks = subclim_tasks.TaskScheduler(
+    workers=settings.get("subclim_worker_threads", 3),
+    per_project=settings.get("subclim_tasks_per_project", 2))
 
 
 def flatten_command_line(lst):
@@ -86,7 +199,7 @@ class SubclimBase(object):
         return (flag, get_context(view)[1])
 
     def get_project(self, flag, view):
-        return (flag, get_context(view)[0])
+        return (flag, command_context(view)[0])
 
     def get_cursor(self, flag, view):
         return (flag, str(view.sel()[0].a))
@@ -116,7 +229,7 @@ class SubclimBase(object):
 
     def build_template(self, template, view=None, **kwargs):
         view = self.find_view(view)
-        k = template.keys()[0]
+        k = list(template.keys())[0]
         handler = getattr(self, 'template_handler', SubclimBase.DEFAULT_HANDLER)
         cmdline = ['-command', k]
         for param in template[k]:
@@ -143,6 +256,9 @@ class SubclimBase(object):
 
     def run_template(self, template, view=None, **kwargs):
         cmdline = self.build_template(template, view, **kwargs)
+        if ('-p', None) in cmdline or ('-f', None) in cmdline:
+            # not in a known project, see command_context
+            return ''
         cmdline.extend(self.get_additional_args(kwargs))
         return self.run_eclim(cmdline)
 
@@ -171,11 +287,47 @@ class EclimCommand(sublime_plugin.TextCommand, SubclimBase):
 
 
 def check_eclim_version():
-    out = SubclimBase.run_template({"ping": []}, {})
-    m = re.search(r'^eclim\s+(.*)$', out, re.MULTILINE)
-    version = int("".join(m.group(1).split(".")))
-    if version < 173:
-        sublime.error_message("Subclim depends on Eclim 1.7.3 or higher. Please update your Eclim installation.")
+    out = eclim.call_eclim(['-command', 'ping'])
+    m = re.search(r'^eclim\s+(\S+)', out, re.MULTILINE)
+    if not m:
+        return
+    version = tuple(int(n) for n in re.findall(r'\d+', m.group(1)))
+    if version < (1, 7, 3):
+        sublime.set_timeout(lambda: sublime.error_message(
+            "Subclim depends on Eclim 1.7.3 or higher. Please update your Eclim installation."), 0)
+
+
+# the version only needs to be checked once per session
+version_checked = False
+
+
+def warm_up():
+    '''Prepares connections and caches in the background, so that the first
+    command or completion does not have to wait for them'''
+    def collect_views():
+        file_names = [v.file_name() for w in sublime.windows() for v in w.views()
+                      if v.file_name() and ("Java" in v.settings().get("syntax", "") or
+                                            "Scala" in v.settings().get("syntax", ""))]
+        tasks.put(lambda: warm_up_task(file_names), subclim_tasks.BACKGROUND)
+
+    def warm_up_task(file_names):
+        global version_checked
+        subclim_overlay.recover()
+        try:
+            if not version_checked:
+                check_eclim_version()
+                version_checked = True
+            if eclim.nailgun_address is not None:
+                eclim.nailgun_pool().fill()
+            eclim.project_index.refresh()
+            for file_name in file_names:
+                project, _ = eclim.get_context(file_name)
+                if file_name.endswith('.java') and settings.get("subclim_class_index", False):
+                    class_index(project)
+        except eclim.EclimExecutionException as e:
+            log.info('Warm-up stopped: %s', e)
+
+    sublime.set_timeout(collect_views, 0)
 
 
 def initialize_eclim_module():
@@ -185,31 +337,174 @@ def initialize_eclim_module():
     eclim_executable = s.get("eclim_executable_location", None)
     # log.debug('eclim_executable = ' + eclim_executable)
     eclim.eclim_executable = eclim_executable
+    eclim.default_timeout = s.get("eclim_timeout", 30)
+    eclim.result_cache.max_entries = s.get("eclim_cache_entries", 256)
+    eclim.result_cache.max_size = s.get("eclim_cache_size", 4 * 1024 * 1024)
+    eclim.close_nailgun_pools()
+    eclim.breaker.close()
+    eclim.nailgun_pool_size = s.get("eclim_nailgun_pool_size", 2)
+    eclim.nailgun_max_idle = s.get("eclim_nailgun_max_idle", 60)
+    if s.get("eclim_use_nailgun", False):
+        host = s.get("eclim_nailgun_host", "localhost")
+        port = s.get("eclim_nailgun_port", None) or eclim.eclimrc_port()
+        eclim.nailgun_address = (host, port)
+    else:
+        eclim.nailgun_address = None
+    eclim.eclimd_executable = s.get("eclimd_executable_location", None)
+    if eclim.eclimd_executable and s.get("eclimd_autostart", False):
+        # warming up has to wait until the server answers
+        tasks.put(lambda: eclim.start_eclimd(on_ready=warm_up), subclim_tasks.BACKGROUND)
+    elif eclim.eclim_executable or eclim.nailgun_address:
+        warm_up()
 
 # when this module is loaded (by ST2), initialize the eclim module
 initialize_eclim_module()
 
 
+def plugin_unloaded():
+    '''Called by ST3 when the plugin is unloaded (or Sublime exits)'''
+    eclim.stop_eclimd()
+# ST2's name for it
+unload_handler = plugin_unloaded
+atexit.register(eclim.stop_eclimd)
+
+
 def check_eclim(view=None):
-    if not eclim.eclim_executable:
+    if not (eclim.eclim_executable or eclim.nailgun_address):
         initialize_eclim_module()
-    if not eclim.eclim_executable:
+    if not (eclim.eclim_executable or eclim.nailgun_address):
         log.error("Eclim executable path not set, call the set_eclim_path command!")
         return False
-    return True
+    # eclimd is known to be down, don't even try
+    return eclim.server_available()
 
 
 def get_context(view):
-    s = view.settings()
-    project = s.get('subclim.project', None)
-    relative_path = s.get('subclim.project_relative_path', None)
+    return eclim.get_context(view.file_name())
+
+
+def command_context(view):
+    '''get_context for commands: tells the user why if the view's file
+    is not in a known project'''
+    project, file = get_context(view)
+    if project is None and view.file_name():
+        if eclim.project_index.loaded():
+            log.error("%s is not in a known Eclipse project" % os.path.basename(view.file_name()))
+        else:
+            log.error("The Eclipse project list is still loading, please try again")
+    return project, file
+
+
+def cache_dir():
+    '''Directory for files Subclim can rebuild, like class indexes'''
+    try:
+        base = sublime.cache_path()
+    except AttributeError:
+        # Sublime Text 2
+        base = os.path.join(sublime.packages_path(), '..', 'Cache')
+    path = os.path.join(base, 'Subclim')
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    return path
+
+
+# project -> ClassIndex, see class_index()
+class_indexes = {}
+# projects whose class index is being built
+class_indexes_building = set()
+
+
+def class_index(project):
+    '''The class index of a project if it is up to date, else None; a
+    stale index is rebuilt in the background. Reads files, so better not
+    called on the main thread.'''
     if project is None:
-        project, relative_path = eclim.get_context(view.file_name())
-        if project is not None:
-            s.set('subclim.project', project)
-        if relative_path is not None:
-            s.set('subclim.project_relative_path', relative_path)
-    return project, relative_path
+        return None
+    index = class_indexes.get(project)
+    if index is None:
+        path = os.path.join(cache_dir(), 'classes-%s.json' % re.sub(r'[^\w.-]', '_', project))
+        index = subclim_classindex.ClassIndex.load(path) or subclim_classindex.ClassIndex(path)
+        class_indexes[project] = index
+        if not index.is_stale():
+            tasks.put(lambda: update_member_indexes(project, index),
+                      subclim_tasks.BACKGROUND, project)
+    if not index.is_stale():
+        return index
+    if project not in class_indexes_building:
+        class_indexes_building.add(project)
+        tasks.put(lambda: build_class_index(project, index), subclim_tasks.BACKGROUND, project)
+    return None
+
+
+def build_class_index(project, index):
+    try:
+        classpath = eclim.call_eclim(['-command', 'java_classpath', '-p', project, '-d', os.pathsep])
+        src_dirs = eclim.call_eclim(['-command', 'java_src_dirs', '-p', project])
+        index.build(split_paths(classpath) + split_paths(src_dirs))
+        index.save()
+        log.info('Indexed %d class names of %s', len(index.names), project)
+        update_member_indexes(project, index)
+    except (eclim.EclimExecutionException, IOError, OSError) as e:
+        log.error('Could not index the classes of %s: %s', project, e)
+    finally:
+        class_indexes_building.discard(project)
+
+
+# member index file -> MemberFile, project -> MemberIndex
+member_files = {}
+member_indexes = {}
+
+
+def update_member_indexes(project, index):
+    '''Builds the member indexes of the jars on a project's classpath that
+    have none or an outdated one, and opens them'''
+    files = []
+    for jar in sorted(index.entries):
+        stamp = subclim_classindex.entry_stamp(jar)
+        if stamp is None or os.path.isdir(jar) or not jar.endswith(('.jar', '.zip')):
+            continue
+        # one file per jar version, a mapped file can't be replaced on Windows
+        prefix = 'members-%s-' % hashlib.sha1(jar.encode('utf-8')).hexdigest()
+        path = os.path.join(cache_dir(), prefix + '%d-%d.idx' % (stamp[0], stamp[1]))
+        member_file = member_files.get(path)
+        if member_file is None:
+            try:
+                if not subclim_memberindex.is_current(jar, path):
+                    log.info('Indexed the members of %d classes in %s',
+                             subclim_memberindex.build(jar, path), jar)
+                    remove_old_member_indexes(prefix, path)
+                member_file = member_files[path] = subclim_memberindex.MemberFile(path)
+            except (IOError, OSError, zipfile.BadZipfile) as e:
+                log.error('Could not index the members of %s: %s', jar, e)
+                continue
+        files.append(member_file)
+    member_indexes[project] = subclim_memberindex.MemberIndex(files)
+
+
+def remove_old_member_indexes(prefix, current):
+    for name in os.listdir(cache_dir()):
+        path = os.path.join(cache_dir(), name)
+        if name.startswith(prefix) and path != current and path not in member_files:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def java_imports(view):
+    '''The package and the imports of a Java file'''
+    package = view.find(r'^\s*package\s+[\w.]+', 0)
+    package = view.substr(package).split()[-1] if package else ''
+    imports = [view.substr(r).split()[-1].rstrip(';')
+               for r in view.find_all(r'^\s*import\s+[\w.*]+\s*;')]
+    return package, imports
+
+
+def split_paths(out):
+    out = out.strip()
+    if out.startswith('"'):
+        out = json.loads(out)
+    return [p for p in re.split('[\n%s]' % re.escape(os.pathsep), out) if p.strip()]
 
 
 def get_classname(view):
@@ -260,13 +555,21 @@ class JavaGotoDefinition(sublime_plugin.TextCommand):
     def run(self, edit, block=False):
         if not check_eclim(self.view):
             return
-        project, file = get_context(self.view)
+        project, file = command_context(self.view)
+        if project is None:
+            return
         pos = self.view.sel()[0]
         word = self.view.word(pos)
         offset = offset_of_location(self.view, word.a)
-        locations = self.call_eclim(project, file, offset, word.size())
-        locations = self.to_list(locations)
+        # a newer goto in this view makes this one obsolete
+        future = eclim.submit(self.call_eclim, (project, file, offset, word.size()),
+                              key=(self.view.id(), 'goto'))
 
+        def on_locations(locations):
+            self.on_locations(self.to_list(locations), word)
+        when_done(future, on_locations)
+
+    def on_locations(self, locations, word):
         #  one definition was found and it is in a java file -> go there
         if len(locations) == 1:
             if locations[0]['filename'].endswith("java"):
@@ -278,15 +581,14 @@ class JavaGotoDefinition(sublime_plugin.TextCommand):
         log.error(error_msg)
 
     def call_eclim(self, project, filename, offset, ident_len, shell=True):
-        eclim.update_java_src(project, filename)
-
         go_to_cmd = ['-command', 'java_search',
                      '-n', project,
                      '-f', filename,
                      '-o', str(offset),
                      '-e', 'utf-8',
                      '-l', str(ident_len)]
-        out = eclim.call_eclim(go_to_cmd)
+        _, out = eclim.call_eclim_batch([
+            eclim.java_src_update_cmd(project, filename), go_to_cmd])
         return out
 
     def to_list(self, locations):
@@ -306,16 +608,7 @@ class JavaGotoDefinition(sublime_plugin.TextCommand):
 
 class JavaGotoUsages(JavaGotoDefinition):
     '''Asks Eclipse for the usage locations and moves ST2 there if found'''
-    def run(self, edit, block=False):
-        if not check_eclim(self.view):
-            return
-        project, file = get_context(self.view)
-        pos = self.view.sel()[0]
-        word = self.view.word(pos)
-        offset = offset_of_location(self.view, word.a)
-        locations = self.call_eclim(project, file, offset, word.size())
-        locations = self.to_list(locations)
-
+    def on_locations(self, locations, word):
         if len(locations) == 1:
             #  one definition was found and it is in a java file -> go there
             if locations[0]['filename'].endswith("java"):
@@ -332,8 +625,6 @@ class JavaGotoUsages(JavaGotoDefinition):
         self.go_to_location(self.locations[selected_idx])
 
     def call_eclim(self, project, filename, offset, ident_len, shell=True):
-        eclim.update_java_src(project, filename)
-
         go_to_cmd = ['-command', 'java_search',
                      '-n', project,
                      '-f', filename,
@@ -341,7 +632,8 @@ class JavaGotoUsages(JavaGotoDefinition):
                      '-e', 'utf-8',
                      '-l', str(ident_len),
                      '-x', 'references']
-        out = eclim.call_eclim(go_to_cmd)
+        _, out = eclim.call_eclim_batch([
+            eclim.java_src_update_cmd(project, filename), go_to_cmd])
         return out
 
 
@@ -393,9 +685,10 @@ class RunClass(object):
         return None
 
     def call_eclim(self, project, file_name, class_name, args=""):
-        eclim.update_java_src(project, file_name)
         go_to_cmd = ['-command', 'java', '-p', project, '-c', class_name, '-a'] + args.split(" ")
-        out = eclim.call_eclim(go_to_cmd)
+        # the program may run as long as it likes
+        _, out = eclim.call_eclim_batch([
+            eclim.java_src_update_cmd(project, file_name), go_to_cmd], timeout=None)
         return out
 
 
@@ -406,7 +699,9 @@ class JavaRunClass(sublime_plugin.TextCommand, RunClass):
     def run(self, edit, block=False):
         if not check_eclim(self.view):
             return
-        project, file_name = get_context(self.view)
+        project, file_name = command_context(self.view)
+        if project is None:
+            return
         class_name, _ = os.path.splitext(os.path.basename(file_name))
         package_name = self.find_package_name()
         if package_name:
@@ -418,7 +713,7 @@ class JavaRunClass(sublime_plugin.TextCommand, RunClass):
             def run_task():
                 result = self.call_eclim(project, file_name, class_name, args)
                 self.display_in_view(result)
-            tasks.put(run_task)
+            tasks.put(run_task, subclim_tasks.RUN, project)
 
         self.get_arguments(callback)
 
@@ -443,7 +738,9 @@ class ScalaRunClass(sublime_plugin.TextCommand, RunClass):
         if not check_eclim(self.view):
             return
 
-        project, file_name = get_context(self.view)
+        project, file_name = command_context(self.view)
+        if project is None:
+            return
         class_name = self.find_qualified_scala_name()
 
         def callback(args):
@@ -452,7 +749,7 @@ class ScalaRunClass(sublime_plugin.TextCommand, RunClass):
             def run_task():
                 result = self.call_eclim(project, file_name, class_name, args)
                 self.display_in_view(result)
-            tasks.put(run_task)
+            tasks.put(run_task, subclim_tasks.RUN, project)
 
         self.get_arguments(callback)
 
@@ -475,38 +772,71 @@ class ScalaRunClass(sublime_plugin.TextCommand, RunClass):
                 return package_name + "." + class_name
 
 
-class CompletionProposal(object):
-    def __init__(self, name, insert=None, type="None"):
-        split = name.split(" ")
-        self.name = "%s\t%s" % (split[0], " ".join(split[1:]))
-        self.display = self.name
-        if insert:
-            self.insert = insert
-        else:
-            self.insert = name
-        self.type = "None"
+def trigger_completions(view):
+    '''Opens the completion popup, which queries JavaCompletions'''
+    JavaCompletions.user_requested = True
+    view.run_command('auto_complete', {
+                     'disable_auto_insert': True,
+                     'api_completions_only': True,
+                     'next_completion_if_showing': False,
+                     })
 
-    def __repr__(self):
-        return "CompletionProposal: %s %s" % (self.name, self.insert)
+
+def save_for_eclim(view):
+    '''Saves view so that eclim sees its contents, without the validation
+    that follows a save by the user'''
+    if not view.is_dirty():
+        return
+    JavaValidation.internal_saves[view.id()] = view.change_count()
+    view.run_command("save")
+    if view.is_dirty():
+        # not saved, e.g. the Save As dialog was cancelled
+        JavaValidation.internal_saves.pop(view.id(), None)
 
 
 class ManualCompletionRequest(sublime_plugin.TextCommand):
     '''Used to request a full Eclim autocompletion when
     auto_complete is turned off'''
     def run(self, edit, block=False):
-        JavaCompletions.user_requested = True
-        self.view.run_command("save")
-        self.view.run_command('auto_complete', {
-                              'disable_auto_insert': True,
-                              'api_completions_only': True,
-                              'next_completion_if_showing': False,
-                              })
+        if not settings.get("subclim_complete_unsaved", False):
+            save_for_eclim(self.view)
+        trigger_completions(self.view)
 
 
 class JavaCompletions(sublime_plugin.EventListener):
-    '''Java/Scala completion provider'''
+    '''Java/Scala completion provider. Completions are fetched in the
+    background; when they arrive, the popup is opened again and answered
+    from JavaCompletions.results.
+
+    A list fetched for a prefix also answers longer prefixes typed at the
+    same place, as the candidates can only get fewer: it is narrowed down
+    locally until the text before the prefix changes.
+
+    With subclim_completion_prefetch on, typing '.', '::' or 'new ' starts
+    fetching the completions at that place in the background, so that
+    they are ready when the popup is requested.
+
+    Until eclim answers, Java names declared in the buffer and keywords
+    are offered (subclim_local_completions); they are kept next to eclim's
+    completions once those arrive.
+
+    Members of library types are completed from the member index built
+    from the project's jars without asking eclim.'''
     # set when the just requested a manual completion, else False
     user_requested = False
+    # view id -> (anchor, prefix, completions, project, their identifiers)
+    # of the last fetch
+    results = {}
+    # view id -> [change count, number of rows, SymbolIndex, rows an edit at
+    # the selections can change] of Java views
+    symbols = {}
+    # view id -> change count of the buffer being scanned for symbols
+    scanning = {}
+    # completions the user picked, to rank them higher next time
+    accepted = subclim_completion.AcceptanceCounts()
+    # view id -> [anchor, whether the popup waits for it] of a running prefetch
+    prefetches = {}
+    prefetch_triggers = ('.', '::', 'new ')
 
     def on_query_completions(self, view, prefix, locations):
         if not (auto_complete or JavaCompletions.user_requested):
@@ -516,25 +846,254 @@ class JavaCompletions(sublime_plugin.EventListener):
         c_func = self.complete_func(view)
         if not c_func:
             return []
+        start = locations[0] - len(prefix)
+        anchor = self.anchor(view, start, len(prefix))
+        local = self.local_completions(view, c_func, prefix, start)
+        cached = JavaCompletions.results.get(view.id())
+        if cached is not None and cached[0] == anchor and \
+                prefix.lower().startswith(cached[1].lower()):
+            local = [c for c in local if subclim_completion.identifier(c[0]) not in cached[4]]
+            return self.rank(cached[2] + local, prefix, cached[3])
+        library = self.library_completions(view, c_func, start)
+        if library is not None:
+            project, completions = library
+            self.on_completions(view, anchor, '', completions, project, show=False)
+            return self.rank(completions, prefix, project)
+        local = self.rank(local, prefix)
+        prefetch = JavaCompletions.prefetches.get(view.id())
+        if prefetch is not None and prefetch[0] == anchor:
+            # opens the popup when it is done
+            prefetch[1] = True
+            return local
         if not check_eclim(view):
-            return []
-        # if we haven't saved yet, push the auto complete to the main thread
+            return local
+        contents = None
         if view.is_dirty():
-            sublime.set_timeout(lambda: self.queue_completions(view), 0)
-            return []
+            if settings.get("subclim_complete_unsaved", False):
+                contents = buffer_contents(view)
+            if contents is None:
+                # if we haven't saved yet, push the auto complete to the main thread
+                sublime.set_timeout(lambda: self.queue_completions(view), 0)
+                return local
         project, fn = get_context(view)
+        if project is None:
+            # not in a project, or the project list is still being fetched
+            return local
         pos = offset_of_location(view, locations[0])
 
-        proposals = self.to_proposals(c_func(project, fn, pos))
-        return [(p.display, p.insert) for p in proposals]
+        def fetch():
+            out = c_func(project, fn, pos, contents=contents)
+            return subclim_completion.decode(out)
+
+        # replaces a completion of this view that is still running
+        future = eclim.submit(fetch, key=(view.id(), 'complete'))
+        when_done(future, lambda completions: self.on_completions(
+            view, anchor, prefix, completions, project))
+        return local
+
+    def anchor(self, view, start, typed):
+        '''What completions fetched for a prefix starting at start stay valid
+        for: the text before it on its line and the size of the buffer
+        without the typed prefix, which changes with edits elsewhere.'''
+        line = view.line(start)
+        return (start, view.substr(sublime.Region(line.begin(), start)), view.size() - typed)
+
+    def at_anchor(self, view, anchor):
+        '''True if the cursor is still in the word started at the anchor:
+        the user may have typed on, but not moved somewhere else'''
+        start = anchor[0]
+        if len(view.sel()) == 0 or view.sel()[0].b < start:
+            return False
+        typed = view.substr(sublime.Region(start, view.sel()[0].b))
+        return re.match(r'\w*$', typed, re.UNICODE) is not None and \
+            self.anchor(view, start, len(typed)) == anchor
+
+    def rank(self, completions, prefix, project=None):
+        return subclim_completion.rank(
+            completions, prefix, JavaCompletions.accepted.counts(project),
+            settings.get("subclim_completion_limit", 200))
+
+    def local_completions(self, view, c_func, prefix, start):
+        '''Names declared in a Java buffer and keywords, not after '.' or
+        '::' where only members make sense'''
+        if c_func != self.call_eclim_java or not settings.get("subclim_local_completions", True) or \
+                (start > 0 and view.substr(start - 1) in ('.', ':')):
+            return []
+        entry = JavaCompletions.symbols.get(view.id())
+        if entry is None or entry[0] != view.change_count():
+            # answers from the names as of the last scan meanwhile
+            self.scan_symbols(view)
+            if entry is None:
+                return []
+        return entry[2].completions(prefix)
+
+    def scan_symbols(self, view):
+        '''Scans the buffer for declared names in the background, unless
+        a scan of it as it is now is running already'''
+        vid = view.id()
+        change_count = view.change_count()
+        if JavaCompletions.scanning.get(vid) == change_count:
+            return
+        JavaCompletions.scanning[vid] = change_count
+        text = view.substr(sublime.Region(0, view.size()))
+        entry = JavaCompletions.symbols.get(vid)
+        previous = entry[2] if entry else None
+
+        def scan_task():
+            index = subclim_symbols.SymbolIndex.from_text(text, previous)
+            sublime.set_timeout(lambda: on_scanned(index), 0)
+
+        def on_scanned(index):
+            if JavaCompletions.scanning.get(vid) != change_count:
+                return
+            del JavaCompletions.scanning[vid]
+            # edited meanwhile: still better than nothing until the next scan
+            rows = edit_rows(view) if view.change_count() == change_count else None
+            JavaCompletions.symbols[vid] = [change_count, text.count('\n') + 1, index, rows]
+
+        tasks.put(scan_task, subclim_tasks.BACKGROUND, key=(vid, 'symbols'))
+
+    def library_completions(self, view, c_func, start):
+        '''(project, members) of the library type or variable of a library
+        type before the '.' at start, from the project's member index.
+        None for anything else, that is for eclim to complete.'''
+        if c_func != self.call_eclim_java or start == 0 or view.substr(start - 1) != '.' or \
+                not settings.get("subclim_class_index", False):
+            return None
+        project, _ = get_context(view)
+        members = member_indexes.get(project)
+        if members is None:
+            return None
+        line = view.line(start)
+        receiver = re.search(r'(?:^|[^\w.)\]])([A-Za-z_]\w*)\s*$',
+                             view.substr(sublime.Region(line.begin(), start - 1)))
+        if receiver is None or receiver.group(1) in ('this', 'super'):
+            return None
+        receiver = receiver.group(1)
+        if receiver[0].isupper():
+            type_name, static = receiver, True
+        else:
+            types = []
+            regions = view.find_all(r'\b([A-Z][\w.]*)(?:\s*<[^;=()]*?>)?\s+%s\s*[=;,:)]' % receiver,
+                                    0, '$1', types)
+            types = [t for r, t in zip(regions, types) if r.end() <= start]
+            if not types:
+                return None
+            type_name, static = types[-1], False
+        package, imports = java_imports(view)
+        classes = class_indexes.get(project)
+        if classes is not None and package + '.' + type_name in classes.lookup(type_name):
+            # a class of the project, maybe not compiled into any jar
+            return None
+        fqn = subclim_memberindex.resolve_type(type_name, package, imports, members.__contains__)
+        if fqn is None:
+            return None
+        completions = members.completions(fqn, static)
+        return (project, completions) if completions is not None else None
+
+    def on_load(self, view):
+        if self.complete_func(view) == self.call_eclim_java and \
+                settings.get("subclim_local_completions", True):
+            self.scan_symbols(view)
+
+    def on_activated(self, view):
+        if view.id() not in JavaCompletions.symbols:
+            self.on_load(view)
+
+    def on_selection_modified(self, view):
+        entry = JavaCompletions.symbols.get(view.id())
+        if entry is not None and entry[0] == view.change_count():
+            entry[3] = edit_rows(view)
+
+    def on_completions(self, view, anchor, prefix, completions, project, show=True):
+        if not self.at_anchor(view, anchor):
+            return
+        names = set(subclim_completion.identifier(subclim_completion.completion_name(c))
+                    for c in completions)
+        JavaCompletions.results[view.id()] = (anchor, prefix, completions, project, names)
+        if show:
+            trigger_completions(view)
+
+    def on_modified(self, view):
+        entry = JavaCompletions.symbols.get(view.id())
+        if entry is not None:
+            # else the next completion rescans the buffer
+            update_rows(view, entry)
+        prefetch = JavaCompletions.prefetches.get(view.id())
+        if prefetch is not None and not self.at_anchor(view, prefetch[0]):
+            del JavaCompletions.prefetches[view.id()]
+            eclim.cancel((view.id(), 'prefetch'))
+        if not settings.get("subclim_completion_prefetch", False) or len(view.sel()) != 1:
+            return
+        pos = view.sel()[0].b
+        if not view.sel()[0].empty() or \
+                not view.substr(sublime.Region(max(pos - 4, 0), pos)).endswith(self.prefetch_triggers) or \
+                view.score_selector(pos - 1, 'comment, string') > 0:
+            return
+        c_func = self.complete_func(view)
+        if c_func and view.file_name():
+            self.prefetch(view, c_func, pos)
+
+    def prefetch(self, view, c_func, pos):
+        if not settings.get("subclim_complete_unsaved", False):
+            return
+        contents = buffer_contents(view)
+        if contents is None or not eclim.server_available():
+            return
+        vid = view.id()
+        project, fn = get_context(view)
+        if project is None:
+            return
+        offset = offset_of_location(view, pos)
+        prefetch = [self.anchor(view, pos, 0), False]
+        JavaCompletions.prefetches[vid] = prefetch
+
+        def fetch():
+            out = c_func(project, fn, offset, contents=contents)
+            return subclim_completion.decode(out)
+
+        def prefetch_task():
+            if JavaCompletions.prefetches.get(vid) is not prefetch:
+                return
+            try:
+                completions = eclim.run_as_call(fetch, (), key=(vid, 'prefetch'))
+            except eclim.EclimExecutionException:
+                completions = None
+            sublime.set_timeout(lambda: on_prefetched(completions), 0)
+
+        def on_prefetched(completions):
+            if JavaCompletions.prefetches.get(vid) is not prefetch:
+                return
+            del JavaCompletions.prefetches[vid]
+            if completions is not None:
+                self.on_completions(view, prefetch[0], '', completions, project,
+                                    show=prefetch[1])
+
+        tasks.put(prefetch_task, subclim_tasks.BACKGROUND, project,
+                  key=(view.buffer_id(), 'prefetch'))
+
+    def on_post_text_command(self, view, command_name, args):
+        '''Counts the completion picked from the popup. Sublime Text 2 does
+        not report it.'''
+        if command_name not in ('commit_completion', 'insert_best_completion'):
+            return
+        cached = JavaCompletions.results.get(view.id())
+        if cached is None or len(view.sel()) == 0 or view.sel()[0].b < cached[0][0]:
+            return
+        name = subclim_completion.identifier(
+            view.substr(sublime.Region(cached[0][0], view.sel()[0].b)))
+        if name in cached[4]:
+            JavaCompletions.accepted.record(cached[3], name)
+
+    def on_close(self, view):
+        JavaCompletions.results.pop(view.id(), None)
+        JavaCompletions.prefetches.pop(view.id(), None)
+        JavaCompletions.symbols.pop(view.id(), None)
+        JavaCompletions.scanning.pop(view.id(), None)
 
     def queue_completions(self, view):
-        view.run_command("save")
-        view.run_command('auto_complete', {
-                         'disable_auto_insert': True,
-                         'api_completions_only': True,
-                         'next_completion_if_showing': False,
-                         })
+        save_for_eclim(view)
+        trigger_completions(view)
 
     def complete_func(self, view):
         syntax = view.settings().get("syntax")
@@ -545,57 +1104,26 @@ class JavaCompletions(sublime_plugin.EventListener):
         else:
             return None
 
-    def call_eclim_java(self, project, file, offset, shell=True):
-        eclim.update_java_src(project, file)
-        complete_cmd = "-command java_complete \
-                                -p %s \
-                                -f %s \
-                                -o %i \
-                                -e utf-8 \
-                                -l compact" % (project, file, offset)
-        out = eclim.call_eclim(complete_cmd)
+    def call_eclim_java(self, project, file, offset, shell=True, contents=None):
+        complete_cmd = ['-command', 'java_complete', '-p', project, '-f', file,
+                        '-o', str(offset), '-e', 'utf-8', '-l', 'compact']
+        cmdlines = [eclim.java_src_update_cmd(project, file), complete_cmd]
+        if contents is not None:
+            _, out = eclim.call_eclim_batch_overlay(project, file, contents, cmdlines)
+        else:
+            _, out = eclim.call_eclim_batch(cmdlines)
         return out
 
-    def call_eclim_scala(self, project, file, offset, shell=True):
-        eclim.update_scala_src(project, file)
-        complete_cmd = "-command scala_complete \
-                                -p %s \
-                                -f %s \
-                                -o %i \
-                                -e utf-8 \
-                                -l compact" % (project, file, offset)
-        out = eclim.call_eclim(complete_cmd)
+    def call_eclim_scala(self, project, file, offset, shell=True, contents=None):
+        complete_cmd = ['-command', 'scala_complete', '-p', project, '-f', file,
+                        '-o', str(offset), '-e', 'utf-8', '-l', 'compact']
+        cmdlines = [eclim.scala_src_update_cmd(project, file), complete_cmd]
+        if contents is not None:
+            _, out = eclim.call_eclim_batch_overlay(project, file, contents, cmdlines)
+        else:
+            _, out = eclim.call_eclim_batch(cmdlines)
         return out
 
-    def to_proposals(self, eclim_output):
-        proposals = []
-
-        completions = json.loads(eclim_output)
-        # newer versions of Eclim package the list of completions in a dict
-        if isinstance(completions, dict):
-            completions = completions['completions']
-        for c in completions:
-            if not "<br/>" in c['info']:  # no overloads
-                proposals.append(CompletionProposal(c['info'], c['completion']))
-            else:
-                variants = c['info'].split("<br/>")
-                param_lists = [re.search(r'\((.*)\)', v) for v in variants]
-                param_lists = [x.group(1) for x in param_lists if x]
-                props = []
-                for idx, pl in enumerate(param_lists):
-                    if pl:
-                        params = [par.split(" ")[-1] for par in pl.split(", ")]
-                        insert = ", ".join(["${%i:%s}" % (i, s)
-                                            for i, s in
-                                            zip(range(1, len(params) + 1), params)
-                                            ])
-                        insert = c['completion'] + insert + ")"
-                        props.append(CompletionProposal(variants[idx], insert))
-                    else:
-                        props.append(CompletionProposal(variants[idx], c['completion']))
-                proposals.extend(props)
-        return proposals
-
 
 class JavaValidation(sublime_plugin.EventListener):
     '''Show Java errors as found by Eclipse on save and load.
@@ -603,6 +1131,13 @@ class JavaValidation(sublime_plugin.EventListener):
 
     drawType = 4 | 32
     line_messages = {}
+    # view id -> change count of the buffer when its last validation was requested
+    submitted = {}
+    # results dropped because a newer validation had been requested
+    stale_results = 0
+    # view id -> change count of views saved by save_for_eclim rather than
+    # by the user
+    internal_saves = {}
 
     def __init__(self, *args, **kwargs):
         sublime_plugin.EventListener.__init__(self, *args, **kwargs)
@@ -632,9 +1167,21 @@ class JavaValidation(sublime_plugin.EventListener):
 
             sublime.set_timeout(validation_closure, 1500)
 
+    def on_pre_save(self, view):
+        if view.file_name():
+            # an overlay of the file must not undo this save
+            subclim_overlay.note_save(view.file_name())
+
     def on_post_save(self, view):
+        if view.file_name():
+            subclim_overlay.note_saved(view.file_name())
+        if os.path.basename(view.file_name() or "") == ".project":
+            eclim.project_index.invalidate()
+        if JavaValidation.internal_saves.pop(view.id(), None) == view.change_count():
+            return
         validation_func = self.validation_func(view)
         if validation_func:
+            eclim.invalidate_cache()
             self.validate(view, validation_func)
 
             # sometimes, Eclipse will not report errors instantly
@@ -643,20 +1190,47 @@ class JavaValidation(sublime_plugin.EventListener):
                 self.validate(view, validation_func)
             sublime.set_timeout(validation_closure, 1500)
 
-    def validate(self, view, validation_func):
+    def on_modified(self, view):
+        '''Validates the unsaved buffer once typing has paused, if
+        subclim_live_validation is on'''
+        if not settings.get("subclim_live_validation", False) or not view.file_name():
+            return
+        validation_func = self.validation_func(view)
+        if not validation_func:
+            return
+        change_count = view.change_count()
+
+        def idle_closure():
+            if view.change_count() != change_count or not view.is_dirty():
+                return
+            contents = buffer_contents(view)
+            if contents is not None:
+                self.validate(view, validation_func, contents)
+        sublime.set_timeout(idle_closure, settings.get("subclim_live_validation_delay", 1000))
+
+    def validate(self, view, validation_func, contents=None):
+        '''Validates the saved file, or contents instead of it if given'''
         if not check_eclim(view):
             return
         project, file = get_context(view)
+        if project is None:
+            return
         problems = {}
+        vid = view.id()
+        change_count = view.change_count()
+        JavaValidation.submitted[vid] = change_count
 
         def async_validate_task():
-            out = validation_func(project, file)
+            out = validation_func(project, file, contents)
             problems.update(eclim.parse_problems(out))
             sublime.set_timeout(on_validation_finished, 0)
 
         def on_validation_finished():
+            # a validation of a newer state of the buffer is on its way
+            if JavaValidation.submitted.get(vid, change_count) > change_count:
+                JavaValidation.stale_results += 1
+                return
             line_messages = JavaValidation.line_messages
-            vid = view.id()
             line_messages[vid] = {}
             for e in problems['errors']:
                 l_no = int(e['line'])
@@ -666,7 +1240,9 @@ class JavaValidation(sublime_plugin.EventListener):
             self.visualize(view)
             self.on_selection_modified(view)
 
-        tasks.put(async_validate_task)
+        # replaces a validation of this buffer that has not started yet
+        tasks.put(async_validate_task, subclim_tasks.VALIDATION, project,
+                  key=(view.buffer_id(), 'validate'))
 
     def visualize(self, view):
         view.erase_regions('subclim-errors')
@@ -701,16 +1277,46 @@ class JavaValidation(sublime_plugin.EventListener):
 class JavaImportClassUnderCursor(sublime_plugin.TextCommand):
     '''Will try to find a suitable class for importing using
     Eclipse's auto import features. Displays a menu if there are
-    alternatives.'''
+    alternatives. If the project's class index includes the JRE and knows
+    exactly one class of that name, outside of the file's package and
+    java.lang, it is imported right away.'''
 
     def run(self, edit, block=False):
         if not check_eclim(self.view):
             return
-        project, _file = get_context(self.view)
+        project, _file = command_context(self.view)
+        if project is None:
+            return
         pos = self.view.sel()[0]
         word = self.view.word(pos)
         offset = offset_of_location(self.view, word.a)
-        self.view.run_command("save")
+        name = self.view.substr(word)
+        package, imports = java_imports(self.view)
+        # a class of the package created since the index was built
+        sibling = os.path.join(os.path.dirname(self.view.file_name()), name + '.java')
+
+        def async_find_imports_task():
+            if settings.get("subclim_class_index", False) and \
+                    not any(i.endswith('.' + name) for i in imports) and \
+                    not os.path.exists(sibling):
+                index = class_index(project)
+                # without the JRE, a JRE class may look like the only candidate
+                if index is not None and index.has_jre():
+                    candidates = index.lookup(name)
+                    # a class of the same package or java.lang needs no import,
+                    # importing another one of that name would shadow it
+                    if len(candidates) == 1 and \
+                            candidates[0].rpartition('.')[0] not in (package, 'java.lang'):
+                        sublime.set_timeout(lambda: self.view.run_command(
+                            "java_add_import_class", {'class_name': candidates[0]}), 0)
+                        return
+            # not indexed yet or several candidates, eclim knows better
+            sublime.set_timeout(lambda: self.find_imports(project, _file, offset), 0)
+
+        tasks.put(async_find_imports_task, subclim_tasks.INTERACTIVE, project)
+
+    def find_imports(self, project, _file, offset):
+        save_for_eclim(self.view)
 
         class_names = []
         message = []
@@ -733,16 +1339,13 @@ class JavaImportClassUnderCursor(sublime_plugin.TextCommand):
                 self.possible_imports = class_names
                 self.show_import_menu()
 
-        tasks.put(async_find_imports_task)
+        tasks.put(async_find_imports_task, subclim_tasks.INTERACTIVE, project)
 
     def call_eclim(self, project, _file, offset):
-        eclim.update_java_src(project, _file)
-        complete_cmd = "-command java_import \
-                                -p %s \
-                                -f %s \
-                                -o %i \
-                                -e utf-8" % (project, _file, offset)
-        result = eclim.call_eclim(complete_cmd)
+        complete_cmd = ['-command', 'java_import', '-p', project, '-f', _file,
+                        '-o', str(offset), '-e', 'utf-8']
+        _, result = eclim.call_eclim_batch([
+            eclim.java_src_update_cmd(project, _file), complete_cmd])
         try:
             result = json.loads(result)
         except ValueError:
@@ -792,11 +1395,12 @@ class EclipseProjects(sublime_plugin.WindowCommand):
     def run(self):
         if not check_eclim(self.window.active_view()):
             return
+        future = eclim.submit(eclim.project_index.projects, key=(self.window.id(), 'projects'))
+        when_done(future, self.on_projects)
+
+    def on_projects(self, ps):
         self.projects = {}
         self.project_paths = []
-        cmd = "-command projects"
-        out = eclim.call_eclim(cmd)
-        ps = json.loads(out.strip())
         for p in ps:
             self.projects[p['name']] = p
             self.project_paths.append([p['name'], p['path']])
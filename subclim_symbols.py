@@ -0,0 +1,142 @@
+'''
+Finds the names declared in a Java buffer: variables, methods, types and
+imports, with a few regular expressions per line. It knows nothing about
+scopes, but answers instantly, while eclim is still thinking. Independent
+of the Sublime Text API.
+'''
+import re
+import bisect
+
+KEYWORDS = (
+    'abstract', 'assert', 'boolean', 'break', 'byte', 'case', 'catch',
+    'char', 'class', 'continue', 'default', 'do', 'double', 'else', 'enum',
+    'extends', 'false', 'final', 'finally', 'float', 'for', 'if',
+    'implements', 'import', 'instanceof', 'int', 'interface', 'long',
+    'native', 'new', 'null', 'package', 'private', 'protected', 'public',
+    'return', 'short', 'static', 'strictfp', 'super', 'switch',
+    'synchronized', 'this', 'throw', 'throws', 'transient', 'true', 'try',
+    'void', 'volatile', 'while',
+)
+KEYWORD_SET = frozenset(KEYWORDS)
+PRIMITIVE_TYPES = frozenset(('boolean', 'byte', 'char', 'double', 'float', 'int',
+                             'long', 'short', 'void'))
+
+# kinds of names, also shown in the completion popup
+VARIABLE = 'variable'
+METHOD = 'method'
+TYPE = 'type'
+IMPORT = 'import'
+KEYWORD = 'keyword'
+
+IMPORT_DECL = re.compile(r'^\s*import\s+(?:static\s+)?[\w.]*?(\w+)\s*;')
+TYPE_DECL = re.compile(r'\b(?:class|interface|enum)\s+(\w+)')
+METHOD_DECL = re.compile(
+    r'^\s*(?:(?:public|protected|private|static|final|abstract|synchronized|native)\s+)*'
+    r'(?:<[^>]*>\s*)?([\w.$]+)(?:\s*<[^;=()]*>)?(?:\s*\[\s*\])*\s+(\w+)\s*\(')
+VARIABLE_DECL = re.compile(
+    r'\b(?:[A-Z][\w.$]*|byte|short|int|long|float|double|boolean|char|var)'
+    r'(?:\s*<[^;=()]*?>)?(?:\s*\[\s*\])*\s+(\w+)\s*(?=[=;,:)])')
+
+
+def scan_line(line):
+    '''The (name, kind) pairs declared in one line of Java'''
+    match = IMPORT_DECL.match(line)
+    if match:
+        return ((match.group(1), IMPORT),)
+    symbols = []
+    for match in TYPE_DECL.finditer(line):
+        symbols.append((match.group(1), TYPE))
+    match = METHOD_DECL.match(line)
+    # the return type can't be a keyword other than a primitive type, this
+    # rules out e.g. "return foo(x)"
+    if match and match.group(2) not in KEYWORD_SET and \
+            (match.group(1) not in KEYWORD_SET or match.group(1) in PRIMITIVE_TYPES):
+        symbols.append((match.group(2), METHOD))
+    for match in VARIABLE_DECL.finditer(line):
+        if match.group(1) not in KEYWORD_SET:
+            symbols.append((match.group(1), VARIABLE))
+    return tuple(symbols)
+
+
+class SymbolIndex(object):
+    '''The symbols of a buffer, by line. After the full scan, only changed
+    lines need to be scanned again. A full rescan looks up lines it has
+    seen before instead of scanning them. The names are also kept sorted
+    by their lower case, so that looking up a prefix is a binary search.'''
+
+    def __init__(self):
+        self.lines = []
+        # name -> {kind: number of declarations}
+        self.names = {}
+        # sorted (name.lower(), name) of self.names
+        self.sorted = []
+        self._memo = {}
+
+    @classmethod
+    def from_text(cls, text, previous=None):
+        '''A new index of text, reusing the lines previous (an index) has
+        seen. Unlike rescan, leaves previous as it is, so it can be used on
+        another thread meanwhile.'''
+        index = cls()
+        if previous is not None:
+            index._memo = previous._memo
+        index.rescan(text)
+        return index
+
+    def rescan(self, text):
+        memo, self._memo = self._memo, {}
+        self.lines = []
+        self.names = {}
+        for line in text.split('\n'):
+            symbols = memo.get(line)
+            if symbols is None:
+                symbols = scan_line(line)
+            self._memo[line] = symbols
+            self.lines.append(symbols)
+            for name, kind in symbols:
+                kinds = self.names.setdefault(name, {})
+                kinds[kind] = kinds.get(kind, 0) + 1
+        self.sorted = sorted((name.lower(), name) for name in self.names)
+
+    def replace_lines(self, first, count, lines):
+        '''Replaces the count lines starting at row first with lines'''
+        for symbols in self.lines[first:first + count]:
+            self._count(symbols, -1)
+        new = [scan_line(line) for line in lines]
+        for symbols in new:
+            self._count(symbols, 1)
+        self.lines[first:first + count] = new
+
+    def _count(self, symbols, n):
+        for name, kind in symbols:
+            kinds = self.names.get(name)
+            if kinds is None:
+                kinds = self.names[name] = {}
+                bisect.insort(self.sorted, (name.lower(), name))
+            kinds[kind] = kinds.get(kind, 0) + n
+            if not kinds[kind]:
+                del kinds[kind]
+                if not kinds:
+                    del self.names[name]
+                    key = (name.lower(), name)
+                    del self.sorted[bisect.bisect_left(self.sorted, key)]
+
+    def completions(self, prefix):
+        '''(display, insert) tuples of the names and keywords starting with
+        prefix, ignoring case'''
+        lower = prefix.lower()
+        result = []
+        i = bisect.bisect_left(self.sorted, (lower,))
+        while i < len(self.sorted) and self.sorted[i][0].startswith(lower):
+            name = self.sorted[i][1]
+            i += 1
+            if name == prefix:
+                continue
+            kinds = self.names[name]
+            kind = METHOD if METHOD in kinds else sorted(kinds)[0]
+            insert = name + '($1)' if kind == METHOD else name
+            result.append((name + '\t' + kind, insert))
+        for keyword in KEYWORDS:
+            if keyword.startswith(lower) and keyword != prefix and keyword not in self.names:
+                result.append((keyword + '\t' + KEYWORD, keyword))
+        return result
@@ -0,0 +1,120 @@
+'''
+Runs Subclim's background tasks on a few worker threads, by priority.
+Independent of the Sublime Text API.
+'''
+import heapq
+import itertools
+import threading
+import traceback
+
+# priority classes, most urgent first
+INTERACTIVE = 0
+RUN = 1
+VALIDATION = 2
+BACKGROUND = 3
+
+
+class TaskScheduler(object):
+    '''Runs tasks on up to 'workers' threads, the most urgent priority class
+    first and in order of submission within a class.
+
+    One worker is kept free for INTERACTIVE tasks, so that a user's request
+    never waits behind validations or indexing, and at most 'per_project'
+    other tasks of the same project run at the same time.
+
+    Tasks can be given a key, e.g. (buffer id, task kind): a task replaces
+    a queued task with the same key that has not started yet.'''
+
+    def __init__(self, workers=3, per_project=2):
+        self.workers = workers
+        self.per_project = per_project
+        self._cond = threading.Condition()
+        self._queue = []  # heap of [priority, sequence number, project, task]
+        self._seq = itertools.count()
+        self._keyed = {}  # key -> queue entry of the task queued with it
+        self._stats = {'run': 0, 'dropped': 0}
+        self._running = {}  # project -> number of its tasks running, INTERACTIVE ones aside
+        self._busy = 0  # workers running a task other than INTERACTIVE ones
+        self._threads = []
+
+    def put(self, task, priority=BACKGROUND, project=None, key=None):
+        with self._cond:
+            entry = [priority, next(self._seq), project, task]
+            if key is not None:
+                replaced = self._keyed.get(key)
+                if replaced is not None and replaced[3] is not None:
+                    # leave it in the heap, it is skipped when it comes up
+                    replaced[3] = None
+                    self._stats['dropped'] += 1
+                self._keyed[key] = entry
+                entry.append(key)
+            heapq.heappush(self._queue, entry)
+            while len(self._threads) < self.workers:
+                t = threading.Thread(target=self.work)
+                t.daemon = True
+                t.start()
+                self._threads.append(t)
+            self._cond.notify_all()
+
+    def pending(self):
+        with self._cond:
+            return len([e for e in self._queue if e[3] is not None])
+
+    def stats(self):
+        '''Numbers of tasks 'run' and 'dropped' in favour of newer ones'''
+        with self._cond:
+            return dict(self._stats)
+
+    def next_task(self):
+        '''Removes and returns the most urgent task allowed to run now, None
+        if there is none. Must be called with the lock held.'''
+        skipped = []
+        found = None
+        while self._queue:
+            entry = heapq.heappop(self._queue)
+            priority, _, project, task = entry[:4]
+            if task is None:
+                continue
+            if priority != INTERACTIVE and self._busy >= max(self.workers - 1, 1):
+                skipped.append(entry)
+                # everything after this one is less urgent
+                break
+            if priority != INTERACTIVE and project is not None and \
+                    self._running.get(project, 0) >= self.per_project:
+                skipped.append(entry)
+                continue
+            found = entry
+            if len(entry) > 4 and self._keyed.get(entry[4]) is entry:
+                del self._keyed[entry[4]]
+            self._stats['run'] += 1
+            break
+        for entry in skipped:
+            heapq.heappush(self._queue, entry)
+        return found
+
+    def work(self):
+        while True:
+            with self._cond:
+                entry = self.next_task()
+                while entry is None:
+                    self._cond.wait()
+                    entry = self.next_task()
+                priority, _, project, task = entry[:4]
+                self.started(priority, project, 1)
+            try:
+                task()
+            except:
+                traceback.print_exc()
+            finally:
+                with self._cond:
+                    self.started(priority, project, -1)
+                    self._cond.notify_all()
+
+    def started(self, priority, project, n):
+        if priority == INTERACTIVE:
+            return
+        self._busy += n
+        if project is not None:
+            self._running[project] = self._running.get(project, 0) + n
+            if not self._running[project]:
+                del self._running[project]
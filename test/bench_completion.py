@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+'''Compares decoding java_complete output the way JavaCompletions used to
+(a CompletionProposal object per variant, uncompiled regex searches) with
+subclim_completion.decode, on generated outputs of several sizes in the
+format of eclim's compact completion layout.
+
+    python bench_completion.py [sizes...]
+'''
+import os
+import re
+import sys
+import json
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import subclim_completion
+
+
+def entry(i):
+    kind = i % 4
+    if kind == 0:
+        return {'completion': 'field%d' % i, 'type': 'f', 'menu': '',
+                'info': 'field%d : List<String> - com.example.Type%d' % (i, i % 50)}
+    if kind == 1:
+        return {'completion': 'size%d()' % i, 'type': 'm', 'menu': '',
+                'info': 'size%d() : int - com.example.Type%d' % (i, i % 50)}
+    if kind == 2:
+        return {'completion': 'put%d(' % i, 'type': 'm', 'menu': '',
+                'info': 'put%d(K key, V value) : V - java.util.Map' % i}
+    variants = ['add%d(%s) : boolean - java.util.List' % (i, params) for params in
+                ('E e', 'int index, E element', 'Collection<? extends E> c', '')]
+    return {'completion': 'add%d(' % i, 'type': 'm', 'menu': '',
+            'info': '<br/>'.join(variants)}
+
+
+def generate(size):
+    return json.dumps({'completions': [entry(i) for i in range(size)]})
+
+
+class CompletionProposal(object):
+    def __init__(self, name, insert=None, type="None"):
+        split = name.split(" ")
+        self.name = "%s\t%s" % (split[0], " ".join(split[1:]))
+        self.display = self.name
+        if insert:
+            self.insert = insert
+        else:
+            self.insert = name
+        self.type = "None"
+
+
+def legacy_decode(eclim_output):
+    proposals = []
+    completions = json.loads(eclim_output)
+    if isinstance(completions, dict):
+        completions = completions['completions']
+    for c in completions:
+        if not "<br/>" in c['info']:
+            proposals.append(CompletionProposal(c['info'], c['completion']))
+        else:
+            variants = c['info'].split("<br/>")
+            param_lists = [re.search(r'\((.*)\)', v) for v in variants]
+            param_lists = [x.group(1) for x in param_lists if x]
+            for idx, pl in enumerate(param_lists):
+                if pl:
+                    params = [par.split(" ")[-1] for par in pl.split(", ")]
+                    insert = ", ".join(["${%i:%s}" % (i, s)
+                                        for i, s in zip(range(1, len(params) + 1), params)])
+                    insert = c['completion'] + insert + ")"
+                    proposals.append(CompletionProposal(variants[idx], insert))
+                else:
+                    proposals.append(CompletionProposal(variants[idx], c['completion']))
+    return [(p.display, p.insert) for p in proposals]
+
+
+def bench(name, fn, output, rounds):
+    start = time.time()
+    for _ in range(rounds):
+        result = fn(output)
+    elapsed = (time.time() - start) / rounds
+    print('%-8s %6d proposals %8.2f ms' % (name, len(result), elapsed * 1000))
+    return result
+
+
+def main(sizes):
+    for size in sizes:
+        output = generate(size)
+        rounds = max(1, 20000 // size)
+        print('%d entries, %d bytes:' % (size, len(output)))
+        assert bench('legacy', legacy_decode, output, rounds) == \
+            bench('decode', subclim_completion.decode, output, rounds)
+        start = time.time()
+        for _ in range(rounds):
+            json.loads(output)
+        print('%-8s %25.2f ms' % ('json', (time.time() - start) / rounds * 1000))
+
+
+if __name__ == '__main__':
+    main([int(a) for a in sys.argv[1:]] or [100, 1000, 5000])
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+'''Compares spawning a client process per eclim call (what the "eclim"
+script does) with talking to the Nailgun server directly, with and
+without pooled connections.
+
+    python bench_nailgun.py [calls]
+'''
+import os
+import sys
+import time
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import nailgun
+from fake_eclimd import FakeEclimd
+
+ARGS = ['-command', 'ping']
+
+# stands in for "eclim" -> "ng": a fresh process that makes a single call
+SPAWN_CLIENT = '''
+import sys
+sys.path.insert(0, %r)
+import nailgun
+code, out, err = nailgun.NailgunClient(%r, %d).run(%r)
+sys.stdout.write(out.decode('utf-8'))
+'''
+
+
+def bench(name, calls, fn):
+    start = time.time()
+    for _ in range(calls):
+        fn()
+    elapsed = time.time() - start
+    print('%-12s %5d calls %8.1f ms total %8.3f ms/call' % (
+        name, calls, elapsed * 1000, elapsed * 1000 / calls))
+
+
+def main(calls):
+    server = FakeEclimd().start()
+    host, port = server.address
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    script = SPAWN_CLIENT % (root, host, port, ARGS)
+
+    def spawn():
+        popen = subprocess.Popen([sys.executable, '-c', script],
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        popen.communicate()
+
+    client = nailgun.NailgunClient(host, port)
+
+    def direct():
+        client.run(ARGS)
+
+    pool = nailgun.NailgunPool(host, port)
+
+    def pooled():
+        pool.run(ARGS)
+
+    bench('subprocess', max(1, calls // 10), spawn)
+    bench('nailgun', calls, direct)
+    bench('pooled', calls, pooled)
+    pool.close()
+    server.close()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+'''Compares computing eclim's UTF-8 byte offset by encoding all text before
+the cursor (what offset_of_location used to do) with ByteOffsetIndex on a
+large generated Java file, the way completion uses them: a keystroke, then
+a lookup at the cursor. The index replaces the edited rows on every
+keystroke, as ByteOffsets.on_modified does. In Sublime, the old way
+additionally copies the text out of the view on every lookup.
+
+    python bench_offsets.py [lines]
+'''
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from subclim_offsets import ByteOffsetIndex, extra_bytes
+
+LINES = [
+    u'    private final Map<String, List<Integer>> field%d = new HashMap<>();',
+    u'    // Kommentar mit Umlauten: Größe, Änderung %d',
+    u'    public int method%d(int a, int b) { return a + b; }',
+    u'    String s%d = "€ 中文";',
+]
+
+
+def generate(lines):
+    return [LINES[i % len(LINES)] % i for i in range(lines)]
+
+
+def keystrokes(rows, bursts=50, burst=10):
+    '''(row, column, text) of typing bursts at random places: umlauts,
+    and every tenth key Enter'''
+    edits = []
+    for _ in range(bursts):
+        row = random.randint(0, len(rows) - 1)
+        col = random.randint(0, len(rows[row]))
+        for k in range(burst):
+            if k % 10 == 9:
+                edits.append((row, col, u'\n'))
+                row, col = row + 1, 0
+            else:
+                edits.append((row, col, u'\u00e4'))
+                col += 1
+    return edits
+
+
+def main(lines):
+    rows = generate(lines)
+    edits = keystrokes(rows)
+
+    start = time.time()
+    index = ByteOffsetIndex.from_text(u'\n'.join(rows))
+    print('index built in %.1f ms (%d lines), only needed again after undo and the like' % (
+        (time.time() - start) * 1000, lines))
+
+    timings = {'encode': 0.0, 'index': 0.0}
+    for row, col, typed in edits:
+        line = rows[row]
+        new_lines = (line[:col] + typed + line[col:]).split(u'\n')
+        rows[row:row + 1] = new_lines
+        # the cursor after the keystroke
+        row, col = row + len(new_lines) - 1, len(new_lines[-1]) - len(line) + col
+        text = u'\n'.join(rows)
+        pos = sum(len(r) + 1 for r in rows[:row]) + col
+
+        start = time.time()
+        expected = len(text[:pos].encode('utf-8'))
+        timings['encode'] += time.time() - start
+
+        start = time.time()
+        index.replace_lines(row - len(new_lines) + 1, 1, new_lines)
+        offset = pos + index.extra_before(row)
+        if index.has_extra(row):
+            offset += extra_bytes(rows[row][:col])
+        timings['index'] += time.time() - start
+        assert offset == expected
+
+    for name in ('encode', 'index'):
+        print('%-10s %6d keystrokes + lookups %9.1f ms total %8.4f ms/keystroke' % (
+            name, len(edits), timings[name] * 1000, timings[name] * 1000 / len(edits)))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+'''Times the local symbol scan JavaCompletions answers from while eclim is
+busy: the first scan of a large generated Java file and a rescan of it
+(both run in the background), rescanning the single line an edit changed
+and looking up the names starting with a prefix, with many and with few
+matches.
+
+    python bench_symbols.py [lines]
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from subclim_symbols import SymbolIndex
+
+LINES = [
+    'import java.util.List%d;',
+    '    private final Map<String, List<Integer>> field%d = new HashMap<>();',
+    '    public int method%d(int a, String b) {',
+    '        String local%d = a + b;',
+    '        return foo(local%d);',
+    '    }',
+]
+
+
+def generate(lines):
+    return '\n'.join(LINES[i % len(LINES)].replace('%d', str(i)) for i in range(lines))
+
+
+def timed(name, fn, rounds=1):
+    start = time.time()
+    for _ in range(rounds):
+        fn()
+    print('%-10s %8.3f ms' % (name, (time.time() - start) * 1000 / rounds))
+
+
+def main(lines):
+    text = generate(lines)
+    index = SymbolIndex()
+    timed('scan', lambda: index.rescan(text))
+    timed('rescan', lambda: index.rescan(text))
+    timed('line', lambda: index.replace_lines(lines // 2, 1, ['        int typed = 1;']), 1000)
+    timed('complete', lambda: index.completions('loc'), 100)
+    timed('narrow', lambda: index.completions('local10'), 1000)
+    print('%d lines, %d names' % (lines, len(index.names)))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
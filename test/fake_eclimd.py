@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+'''A stand-in for eclimd: a Nailgun server that answers a few eclim commands
+with canned responses. Used by the benchmarks, can also be started on its
+own:
+
+    python fake_eclimd.py [port]
+'''
+import os
+import sys
+import socket
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import nailgun
+
+RESPONSES = {
+    'ping': 'eclim   1.7.14\neclipse 4.2.2\n',
+    'project_list': '[]',
+    'projects': '[]',
+    'java_src_update': '[]',
+}
+
+
+class FakeEclimd(object):
+    def __init__(self, host='127.0.0.1', port=0, responses=None, exit_on_shutdown=False):
+        self.exit_on_shutdown = exit_on_shutdown
+        self.responses = dict(RESPONSES)
+        self.responses.update(responses or {})
+        self.calls = []
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(64)
+        self.address = self.server.getsockname()
+
+    def start(self):
+        t = threading.Thread(target=self.serve_forever)
+        t.daemon = True
+        t.start()
+        return self
+
+    def serve_forever(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except socket.error:
+                return
+            t = threading.Thread(target=self.handle, args=(conn,))
+            t.daemon = True
+            t.start()
+
+    def close(self):
+        self.server.close()
+
+    def handle(self, conn):
+        args = []
+        try:
+            while True:
+                header = nailgun.recv_exactly(conn, nailgun.HEADER.size)
+                length, chunk_type = nailgun.HEADER.unpack(header)
+                payload = nailgun.recv_exactly(conn, length) if length else b''
+                if chunk_type == nailgun.CHUNK_ARGUMENT:
+                    args.append(payload.decode('utf-8'))
+                elif chunk_type == nailgun.CHUNK_COMMAND:
+                    break
+            self.calls.append(args)
+            out, err, code = self.respond(args)
+            if out:
+                conn.sendall(nailgun.encode_chunk(nailgun.CHUNK_STDOUT, out))
+            if err:
+                conn.sendall(nailgun.encode_chunk(nailgun.CHUNK_STDERR, err))
+            conn.sendall(nailgun.encode_chunk(nailgun.CHUNK_EXIT, str(code)))
+        except (socket.error, nailgun.NailgunError):
+            pass
+        finally:
+            conn.close()
+        if self.exit_on_shutdown and args[-1:] == ['shutdown']:
+            os._exit(0)
+
+    def respond(self, args):
+        command = args[args.index('-command') + 1] if '-command' in args else None
+        if command in self.responses:
+            return self.responses[command], '', 0
+        return '', 'No command %s found.\n' % command, 1
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else nailgun.DEFAULT_PORT
+    server = FakeEclimd(port=port, responses={'shutdown': ''}, exit_on_shutdown=True)
+    print('fake eclimd listening on %s:%s' % server.address)
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.close()
@@ -0,0 +1,323 @@
+'''Queries JavaCompletions the way Sublime Text does, with a stand-in for
+the sublime and sublime_plugin modules and a view over a string.
+
+    python -m unittest test_completions
+'''
+import os
+import sys
+import re
+import json
+import time
+import types
+import threading
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class Settings(dict):
+    def get(self, key, default=None):
+        return dict.get(self, key, default)
+
+    def set(self, key, value):
+        self[key] = value
+
+    def add_on_change(self, key, callback):
+        pass
+
+
+class Region(object):
+    def __init__(self, a, b=None):
+        self.a = a
+        self.b = a if b is None else b
+
+    def begin(self):
+        return min(self.a, self.b)
+
+    def end(self):
+        return max(self.a, self.b)
+
+    def empty(self):
+        return self.a == self.b
+
+    def size(self):
+        return self.end() - self.begin()
+
+    def __len__(self):
+        return self.size()
+
+
+class View(object):
+    '''A saved Java view with one cursor'''
+
+    def __init__(self, text, cursor):
+        self.text = text
+        self.cursor = cursor
+        self.commands = []
+        self.command_args = []
+        self.view_settings = Settings(syntax='Packages/Java/Java.tmLanguage')
+
+    def id(self):
+        return 1
+
+    def buffer_id(self):
+        return 1
+
+    def settings(self):
+        return self.view_settings
+
+    def file_name(self):
+        return '/work/app/src/A.java'
+
+    def is_dirty(self):
+        return False
+
+    def change_count(self):
+        return 0
+
+    def size(self):
+        return len(self.text)
+
+    def encoding(self):
+        return 'UTF-8'
+
+    def line_endings(self):
+        return 'Unix'
+
+    def sel(self):
+        return [Region(self.cursor)]
+
+    def substr(self, region):
+        if isinstance(region, int):
+            return self.text[region:region + 1]
+        return self.text[region.begin():region.end()]
+
+    def line(self, point):
+        begin = self.text.rfind('\n', 0, point) + 1
+        end = self.text.find('\n', point)
+        return Region(begin, len(self.text) if end < 0 else end)
+
+    def rowcol(self, point):
+        return self.text.count('\n', 0, point), point - self.text.rfind('\n', 0, point) - 1
+
+    def find_all(self, pattern, flags=0, fmt=None, extractions=None):
+        # Sublime's regexes write code points as \x{80}
+        pattern = re.sub(r'\\x\{(\w+)\}', lambda m: '\\U%08x' % int(m.group(1), 16), pattern)
+        matches = list(re.finditer(pattern, self.text, re.MULTILINE))
+        if extractions is not None:
+            extractions.extend(m.expand(fmt.replace('$', '\\')) for m in matches)
+        return [Region(m.start(), m.end()) for m in matches]
+
+    def find(self, pattern, start, flags=0):
+        m = re.compile(pattern, re.MULTILINE).search(self.text, start)
+        return Region(m.start(), m.end()) if m else Region(-1, -1)
+
+    def word(self, region):
+        point = region.begin() if isinstance(region, Region) else region
+        begin = end = point
+        while begin > 0 and re.match(r'\w', self.text[begin - 1]):
+            begin -= 1
+        while end < len(self.text) and re.match(r'\w', self.text[end]):
+            end += 1
+        return Region(begin, end)
+
+    def run_command(self, name, args=None):
+        self.commands.append(name)
+        self.command_args.append(args)
+
+
+def install_sublime():
+    sublime = types.ModuleType('sublime')
+    sublime.Region = Region
+    sublime.View = View
+    sublime.Window = type('Window', (object,), {})
+    sublime.load_settings = lambda name: Settings()
+    sublime.set_timeout = lambda callback, delay: callback()
+    sublime.active_window = lambda: None
+    sublime.windows = lambda: []
+    sublime.error_message = lambda message: None
+    sublime_plugin = types.ModuleType('sublime_plugin')
+    for name in ('EventListener', 'TextCommand', 'WindowCommand'):
+        setattr(sublime_plugin, name, type(name, (object,), {'__init__': lambda self, *a: None}))
+    sys.modules['sublime'] = sublime
+    sys.modules['sublime_plugin'] = sublime_plugin
+
+
+def import_plugin():
+    '''Imports subclim_plugin as Sublime Text 3 does, as part of a package'''
+    install_sublime()
+    package = types.ModuleType('Subclim')
+    package.__path__ = [os.path.join(HERE, '..')]
+    sys.modules['Subclim'] = package
+    __import__('Subclim.subclim_plugin')
+    return sys.modules['Subclim.subclim_plugin']
+
+
+plugin = import_plugin()
+eclim = plugin.eclim
+
+SOURCE = 'class A {\n    int count;\n    void run() {\n        co\n    }\n}\n'
+ECLIM_OUTPUT = json.dumps([
+    {'completion': 'compareTo(', 'info': 'compareTo(Object o) : int - A'},
+    {'completion': 'count', 'info': 'count : int - A'},
+])
+
+
+class TestJavaCompletions(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.completions = plugin.JavaCompletions()
+        self.view = View(SOURCE, SOURCE.index('co\n') + 2)
+        plugin.JavaCompletions.results.clear()
+        plugin.JavaCompletions.symbols.clear()
+        plugin.JavaCompletions.scanning.clear()
+        plugin.auto_complete = True
+        eclim.eclim_executable = 'eclim'
+        self.call_eclim_java = plugin.JavaCompletions.call_eclim_java
+        plugin.JavaCompletions.call_eclim_java = self.call_eclim
+        self.get_context = plugin.get_context
+        plugin.get_context = lambda view: ('app', 'src/A.java')
+
+    def tearDown(self):
+        plugin.JavaCompletions.call_eclim_java = self.call_eclim_java
+        plugin.get_context = self.get_context
+        eclim.eclim_executable = None
+
+    def call_eclim(self, project, file, offset, shell=True, contents=None):
+        self.calls.append(offset)
+        return ECLIM_OUTPUT
+
+    def query(self, prefix):
+        return self.completions.on_query_completions(self.view, prefix, [self.view.cursor])
+
+    def names(self, completions):
+        return [c[0].split('\t')[0] for c in completions]
+
+    def wait_for_popup(self):
+        deadline = time.time() + 5
+        while 'auto_complete' not in self.view.commands and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.view.commands, ['auto_complete'])
+
+    def scan(self):
+        '''Loads the view, which scans it for declared names'''
+        self.completions.on_load(self.view)
+        deadline = time.time() + 5
+        while self.view.id() not in plugin.JavaCompletions.symbols and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_before_scan(self):
+        # no local names yet, but the scan has been started
+        self.assertEqual(self.query('co'), [])
+        self.wait_for_popup()
+        self.scan()
+        self.assertEqual(self.names(self.query('co')), ['continue', 'count', 'compareTo(Object'])
+
+    def test_query(self):
+        # local names right away, eclim's completions when the popup reopens
+        self.scan()
+        self.assertEqual(self.query('co'), [('continue\tkeyword', 'continue'),
+                                            ('count\tvariable', 'count')])
+        self.wait_for_popup()
+        self.assertEqual(self.calls, [SOURCE.index('co\n') + 2])
+        self.assertEqual(self.names(self.query('co')), ['continue', 'count', 'compareTo(Object'])
+
+    def test_narrows_cached(self):
+        self.scan()
+        self.query('co')
+        self.wait_for_popup()
+        self.view.text = SOURCE.replace('co\n', 'cou\n')
+        self.view.cursor += 1
+        self.assertEqual(self.names(self.query('cou')), ['count'])
+        self.assertEqual(len(self.calls), 1)
+
+
+
+class TestWithoutProject(unittest.TestCase):
+    '''Until project_list arrives, no file is known to be in a project'''
+    def setUp(self):
+        self.view = View(SOURCE, 0)
+        self.submit = eclim.submit
+        eclim.submit = self.fail
+        eclim.eclim_executable = 'eclim'
+        self.get_context = plugin.get_context
+        plugin.get_context = lambda view: (None, None)
+
+    def tearDown(self):
+        eclim.submit = self.submit
+        eclim.eclim_executable = None
+        plugin.get_context = self.get_context
+
+    def test_commands_do_nothing(self):
+        for command in (plugin.JavaGotoDefinition, plugin.JavaGotoUsages, plugin.JavaRunClass,
+                        plugin.JavaImportClassUnderCursor):
+            c = command()
+            c.view = self.view
+            c.run(None)
+        self.assertEqual(self.view.commands, [])
+
+    def test_template(self):
+        c = plugin.SubclimBase()
+        c.run_eclim = self.fail
+        self.assertEqual(c.run_template({'javac': ['-p project']}, self.view), '')
+
+
+
+class ClassIndex(object):
+    def __init__(self, *names):
+        self.names = names
+
+    def has_jre(self):
+        return True
+
+    def lookup(self, name):
+        return [n for n in self.names if n.endswith('.' + name)]
+
+
+class TestImportClass(unittest.TestCase):
+    SOURCE = 'package app;\n\nclass A {\n    Node node;\n}\n'
+
+    def setUp(self):
+        self.view = View(self.SOURCE, self.SOURCE.index('Node'))
+        self.command = plugin.JavaImportClassUnderCursor()
+        self.command.view = self.view
+        self.asked_eclim = threading.Event()
+        self.command.find_imports = lambda *args: self.asked_eclim.set()
+        eclim.eclim_executable = 'eclim'
+        plugin.settings['subclim_class_index'] = True
+        self.get_context = plugin.get_context
+        plugin.get_context = lambda view: ('app', 'src/A.java')
+        self.class_index = plugin.class_index
+
+    def tearDown(self):
+        eclim.eclim_executable = None
+        del plugin.settings['subclim_class_index']
+        plugin.get_context = self.get_context
+        plugin.class_index = self.class_index
+
+    def run_command(self, *classes):
+        plugin.class_index = lambda project: ClassIndex(*classes)
+        self.command.run(None)
+        deadline = time.time() + 5
+        while not (self.view.commands or self.asked_eclim.is_set()) and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_imports_only_candidate(self):
+        self.run_command('org.w3c.dom.Node', 'java.util.List')
+        self.assertEqual(self.view.commands, ['java_add_import_class'])
+        self.assertEqual(self.view.command_args, [{'class_name': 'org.w3c.dom.Node'}])
+        self.assertFalse(self.asked_eclim.is_set())
+
+    def test_same_package_needs_no_import(self):
+        self.run_command('org.w3c.dom.Node', 'app.Node')
+        self.assertEqual(self.view.commands, [])
+        self.assertTrue(self.asked_eclim.is_set())
+
+    def test_only_candidate_in_same_package(self):
+        self.run_command('app.Node')
+        self.assertEqual(self.view.commands, [])
+        self.assertTrue(self.asked_eclim.is_set())
+
+
+if __name__ == '__main__':
+    unittest.main()
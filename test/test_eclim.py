@@ -0,0 +1,341 @@
+'''Runs calls through the eclim module, against fake_eclimd.py where they
+need a server.
+
+    python -m unittest test_eclim
+'''
+import os
+import time
+import json
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+# the eclim module logs through Sublime, import it the way the plugin does
+from test_completions import eclim
+from fake_eclimd import FakeEclimd
+
+
+class EclimdTestCase(unittest.TestCase):
+    '''Sends the eclim module's calls to a fresh fake eclimd'''
+    responses = {'java_search': '[]'}
+
+    def setUp(self):
+        self.server = self.make_server().start()
+        eclim.nailgun_address = self.server.address
+        eclim.breaker.close()
+        eclim.result_cache.clear()
+
+    def make_server(self):
+        return FakeEclimd(responses=self.responses)
+
+    def tearDown(self):
+        eclim.nailgun_address = None
+        eclim.close_nailgun_pools()
+        self.server.close()
+
+    def commands(self):
+        return [args[args.index('-command') + 1] for args in self.server.calls]
+
+
+class BlockingEclimd(FakeEclimd):
+    '''Holds java_complete until released'''
+    def __init__(self, **kwargs):
+        FakeEclimd.__init__(self, **kwargs)
+        self.release = threading.Event()
+
+    def respond(self, args):
+        if 'java_complete' in args:
+            self.release.wait(10)
+            return '[]', '', 0
+        return FakeEclimd.respond(self, args)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class TestArgList(unittest.TestCase):
+    def test_keeps_backslashes(self):
+        self.assertEqual(eclim.arg_list(r'-command java_complete -f src\com\Foo.java'),
+                         ['-command', 'java_complete', '-f', r'src\com\Foo.java'])
+
+    def test_quotes(self):
+        self.assertEqual(eclim.arg_list('-p "my app" -f \'A B.java\''),
+                         ['-p', 'my app', '-f', 'A B.java'])
+
+
+class TestResultCache(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = eclim.ResultCache(max_entries=2)
+        cache.put('a', 'A')
+        cache.put('b', 'B')
+        cache.get('a')
+        cache.put('c', 'C')
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), ('A', None, 'C'))
+        self.assertEqual(len(cache), 2)
+
+    def test_evicts_by_size(self):
+        cache = eclim.ResultCache(max_size=10)
+        cache.put('a', 'x' * 4)
+        cache.put('b', 'x' * 4)
+        cache.put('c', 'x' * 4)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(len(cache), 2)
+        # too big to be cached at all
+        cache.put('d', 'x' * 11)
+        self.assertEqual(cache.get('d'), None)
+        self.assertEqual(len(cache), 2)
+
+
+class TestCachedCalls(EclimdTestCase):
+    search = ['-command', 'java_search', '-p', 'app', '-t', 'class', '-x', 'declarations']
+
+    def test_cached_until_sources_change(self):
+        self.assertEqual(eclim.call_eclim(self.search), '[]')
+        self.assertEqual(eclim.call_eclim(self.search), '[]')
+        self.assertEqual(self.commands(), ['java_search'])
+        eclim.call_eclim(['-command', 'java_src_update', '-p', 'app', '-f', 'A.java'])
+        eclim.call_eclim(self.search)
+        self.assertEqual(self.commands(), ['java_search', 'java_src_update', 'java_search'])
+
+    def test_invalidate(self):
+        eclim.call_eclim(self.search)
+        eclim.invalidate_cache()
+        eclim.call_eclim(self.search)
+        self.assertEqual(self.commands(), ['java_search', 'java_search'])
+
+
+
+class TestEclimFuture(unittest.TestCase):
+    def test_cancel(self):
+        future = eclim.EclimFuture()
+        aborted = []
+        done = []
+        future.set_abort(lambda: aborted.append(True))
+        future.add_done_callback(done.append)
+        self.assertTrue(future.cancel())
+        self.assertFalse(future.cancel())
+        self.assertTrue(future.cancelled())
+        self.assertEqual((aborted, done), ([True], [future]))
+        self.assertRaises(eclim.EclimCancelledException, future.result)
+
+    def test_result_does_not_abort(self):
+        future = eclim.EclimFuture()
+        aborted = []
+        future.set_abort(lambda: aborted.append(True))
+        future.set_result('out')
+        self.assertEqual(future.result(), 'out')
+        self.assertEqual(aborted, [])
+
+    def test_watchdog_expires(self):
+        futures = [eclim.EclimFuture(0.2), eclim.EclimFuture(0.1), eclim.EclimFuture(5)]
+        self.assertTrue(wait_for(lambda: futures[0].done()))
+        self.assertTrue(futures[1].done())
+        self.assertFalse(futures[2].done())
+        self.assertRaises(eclim.EclimTimeoutException, futures[0].result)
+        self.assertFalse(futures[0].cancelled())
+        self.assertTrue(futures[0].aborted())
+        futures[2].set_result(None)
+
+
+class BlockingTestCase(EclimdTestCase):
+    complete = ['-command', 'java_complete', '-p', 'app', '-f', 'A.java', '-o', '10']
+
+    def make_server(self):
+        return BlockingEclimd(responses=self.responses)
+
+    def tearDown(self):
+        self.server.release.set()
+        EclimdTestCase.tearDown(self)
+
+    def start(self, timeout=eclim.DEFAULT, key=None):
+        '''Runs the completion call on a thread, returns (thread, [output
+        or exception])'''
+        result = []
+
+        def run():
+            try:
+                result.append(eclim.call_eclim(self.complete, timeout, key))
+            except Exception as e:
+                result.append(e)
+        t = threading.Thread(target=run)
+        t.daemon = True
+        t.start()
+        return t, result
+
+
+class TestSupersede(BlockingTestCase):
+    def test_newer_call_cancels_older(self):
+        first = eclim.call_eclim_async(self.complete, key=('view', 'complete'))
+        self.assertTrue(wait_for(lambda: len(self.server.calls) == 1))
+        second = eclim.call_eclim_async(self.complete, key=('view', 'complete'))
+        self.assertTrue(first.cancelled())
+        self.assertRaises(eclim.EclimCancelledException, first.result, 5)
+        self.server.release.set()
+        self.assertEqual(second.result(5), '[]')
+
+    def test_cancel_by_key(self):
+        future = eclim.call_eclim_async(self.complete, key='k')
+        eclim.cancel('k')
+        self.assertRaises(eclim.EclimCancelledException, future.result, 5)
+
+
+class TestCoalesce(BlockingTestCase):
+    def test_identical_calls_share_one_execution(self):
+        before = eclim.stats()
+        leader, first = self.start()
+        self.assertTrue(wait_for(lambda: len(self.server.calls) == 1))
+        follower, second = self.start()
+        self.assertTrue(wait_for(lambda: eclim.stats()['coalesced'] == before['coalesced'] + 1))
+        self.server.release.set()
+        leader.join(5)
+        follower.join(5)
+        self.assertEqual((first, second), (['[]'], ['[]']))
+        self.assertEqual(len(self.server.calls), 1)
+        self.assertEqual(eclim.stats()['executed'], before['executed'] + 1)
+
+    def test_retry_after_leader_timed_out(self):
+        before = eclim.stats()
+        leader, first = self.start(timeout=0.3)
+        self.assertTrue(wait_for(lambda: len(self.server.calls) == 1))
+        follower, second = self.start()
+        self.assertTrue(wait_for(lambda: eclim.stats()['coalesced'] == before['coalesced'] + 1))
+        leader.join(5)
+        self.assertTrue(isinstance(first[0], eclim.EclimTimeoutException))
+        # the waiting call runs the command itself
+        self.assertTrue(wait_for(lambda: len(self.server.calls) == 2))
+        self.server.release.set()
+        follower.join(5)
+        self.assertEqual(second, ['[]'])
+        counters = eclim.stats()
+        self.assertEqual(counters['executed'], before['executed'] + 2)
+        self.assertEqual(counters['coalesced'], before['coalesced'])
+
+    def test_retry_after_leader_cancelled(self):
+        leader = eclim.call_eclim_async(self.complete, key='leader')
+        self.assertTrue(wait_for(lambda: len(self.server.calls) == 1))
+        follower, second = self.start()
+        self.assertTrue(wait_for(lambda: len(eclim._flights[tuple(self.complete)].waiters) == 1))
+        eclim.cancel('leader')
+        self.assertRaises(eclim.EclimCancelledException, leader.result, 5)
+        self.assertTrue(wait_for(lambda: len(self.server.calls) == 2))
+        self.server.release.set()
+        follower.join(5)
+        self.assertEqual(second, ['[]'])
+
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    ping = ['-command', 'ping']
+
+    def setUp(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        self.address = sock.getsockname()
+        sock.close()
+        self.server = None
+        self.breaker = eclim.breaker
+        eclim.breaker = eclim.CircuitBreaker(threshold=2, min_delay=0.05, max_delay=0.1)
+        eclim.nailgun_address = self.address
+
+    def tearDown(self):
+        eclim.breaker.close()
+        eclim.breaker = self.breaker
+        eclim.nailgun_address = None
+        eclim.close_nailgun_pools()
+        if self.server is not None:
+            self.server.close()
+
+    def test_opens_and_closes(self):
+        for _ in range(2):
+            self.assertFalse(eclim.breaker.is_open())
+            self.assertRaises(eclim.EclimConnectionException, eclim.call_eclim, self.ping)
+        self.assertTrue(eclim.breaker.is_open())
+        self.assertFalse(eclim.server_available())
+
+        # fails fast while open, without trying to connect
+        self.server = FakeEclimd(*self.address).start()
+        self.assertRaises(eclim.EclimConnectionException, eclim.call_eclim, self.ping)
+        self.assertEqual(self.server.calls, [])
+
+        # closed by the first successful probe
+        self.assertTrue(wait_for(eclim.server_available))
+        self.assertTrue(self.server.calls)
+        self.assertTrue(eclim.call_eclim(self.ping).startswith('eclim'))
+
+    def test_success_resets_count(self):
+        self.assertRaises(eclim.EclimConnectionException, eclim.call_eclim, self.ping)
+        self.server = FakeEclimd().start()
+        eclim.nailgun_address = self.server.address
+        eclim.call_eclim(self.ping)
+        eclim.nailgun_address = self.address
+        self.assertRaises(eclim.EclimConnectionException, eclim.call_eclim, self.ping)
+        self.assertFalse(eclim.breaker.is_open())
+
+
+
+class FileEclimd(FakeEclimd):
+    '''Records the contents of the file each java_src_update reads'''
+    def __init__(self, path):
+        FakeEclimd.__init__(self, responses={'java_complete': '[]'})
+        self.path = path
+        self.seen = []
+
+    def respond(self, args):
+        if 'java_src_update' in args:
+            with open(self.path, 'rb') as f:
+                self.seen.append(f.read())
+        return FakeEclimd.respond(self, args)
+
+
+class TestOverlay(EclimdTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'A.java')
+        with open(self.path, 'wb') as f:
+            f.write(b'class A {}\n')
+        EclimdTestCase.setUp(self)
+        self.project_index = eclim.project_index
+        eclim.project_index = eclim.ProjectIndex()
+        eclim.project_index.update(json.dumps([{'name': 'app', 'path': self.dir}]))
+
+    def tearDown(self):
+        eclim.project_index = self.project_index
+        EclimdTestCase.tearDown(self)
+        shutil.rmtree(self.dir)
+
+    def make_server(self):
+        return FileEclimd(os.path.join(self.dir, 'A.java'))
+
+    def test_updates_restored_file(self):
+        eclim.update_java_src('app', 'A.java', b'class A { int x; }\n')
+        # Eclipse is left with the saved version
+        self.assertEqual(self.server.seen, [b'class A { int x; }\n', b'class A {}\n'])
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), b'class A {}\n')
+        # which the next batch does not need to update again
+        eclim.call_eclim_batch([eclim.java_src_update_cmd('app', 'A.java')])
+        self.assertEqual(len(self.server.seen), 2)
+
+    def test_batch(self):
+        complete = ['-command', 'java_complete', '-p', 'app', '-f', 'A.java', '-o', '10']
+        outputs = eclim.call_eclim_batch_overlay(
+            'app', 'A.java', b'class A { int x; }\n',
+            [eclim.java_src_update_cmd('app', 'A.java'), complete])
+        self.assertEqual(outputs, ['[]', '[]'])
+        self.assertEqual(self.server.seen, [b'class A { int x; }\n', b'class A {}\n'])
+
+    def test_failed_batch(self):
+        self.assertRaises(eclim.EclimExecutionException, eclim.call_eclim_batch_overlay,
+                          'app', 'A.java', b'class A { int x; }\n',
+                          [eclim.java_src_update_cmd('app', 'A.java'), ['-command', 'unknown']])
+        self.assertEqual(self.server.seen, [b'class A { int x; }\n', b'class A {}\n'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+'''Runs the eclimd supervisor against fake_eclimd.py as a stand-in server.
+
+    python -m unittest test_eclimd
+'''
+import os
+import sys
+import time
+import socket
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+import nailgun
+from eclimd import EclimdSupervisor
+from fake_eclimd import FakeEclimd
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class TestEclimdSupervisor(unittest.TestCase):
+    def setUp(self):
+        self.port = free_port()
+        self.ready = []
+        self.client = nailgun.NailgunClient('127.0.0.1', self.port, timeout=2.0)
+        self.supervisor = EclimdSupervisor(
+            [sys.executable, os.path.join(HERE, 'fake_eclimd.py'), str(self.port)],
+            ('127.0.0.1', self.port), ready_check=self.ping,
+            shutdown=lambda: self.client.run(['-command', 'shutdown']),
+            on_ready=lambda: self.ready.append(self.ping()),
+            poll_interval=0.1, min_restart_delay=0.1, max_restart_delay=1.0)
+
+    def tearDown(self):
+        self.supervisor.stop(timeout=2.0)
+
+    def ping(self):
+        try:
+            return self.client.run(['-command', 'ping'])[0] == 0
+        except nailgun.NailgunError:
+            return False
+
+    def test_start_until_ready(self):
+        self.assertTrue(self.supervisor.start())
+        self.assertTrue(self.supervisor.wait_ready(10))
+        self.assertTrue(self.ping())
+        deadline = time.time() + 10
+        while not self.ready and time.time() < deadline:
+            time.sleep(0.05)
+        # called once the server answers
+        self.assertEqual(self.ready, [True])
+
+    def test_restart_after_crash(self):
+        self.supervisor.start()
+        self.assertTrue(self.supervisor.wait_ready(10))
+        self.supervisor.process.kill()
+        deadline = time.time() + 10
+        while self.supervisor.restarts == 0 and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertTrue(self.supervisor.wait_ready(10))
+        self.assertEqual(self.supervisor.restarts, 1)
+
+    def test_stop(self):
+        self.supervisor.start()
+        self.assertTrue(self.supervisor.wait_ready(10))
+        process = self.supervisor.process
+        self.supervisor.stop(timeout=2.0)
+        self.assertNotEqual(process.poll(), None)
+        self.assertFalse(self.ping())
+
+    def test_leaves_running_server_alone(self):
+        server = FakeEclimd(port=self.port).start()
+        try:
+            self.assertFalse(self.supervisor.start())
+            self.assertTrue(self.supervisor.is_ready())
+            self.assertEqual(self.supervisor.process, None)
+            self.assertEqual(self.ready, [True])
+        finally:
+            server.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+'''Builds member indexes from jars of generated class files.
+
+    python -m unittest test_memberindex
+'''
+import os
+import sys
+import shutil
+import struct
+import zipfile
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import subclim_memberindex as mi
+
+
+def make_class(name, super_class='java/lang/Object', interfaces=(), fields=(), methods=(),
+               access=mi.ACC_PUBLIC):
+    '''A minimal class file; fields and methods are (flags, name, descriptor)'''
+    pool = []
+
+    def add(entry):
+        pool.append(entry)
+        return len(pool)
+
+    def utf8(s):
+        data = s.encode('utf-8')
+        return add(struct.pack('>BH', 1, len(data)) + data)
+
+    def class_ref(s):
+        return add(struct.pack('>BH', 7, utf8(s)))
+
+    this_index = class_ref(name)
+    super_index = class_ref(super_class) if super_class else 0
+    interface_indexes = [class_ref(i) for i in interfaces]
+    # a long takes two entries
+    add(struct.pack('>Bq', 5, 42))
+    pool.append(b'')
+    code = utf8('Code')
+
+    def members(entries):
+        out = struct.pack('>H', len(entries))
+        for flags, member_name, descriptor in entries:
+            out += struct.pack('>HHHH', flags, utf8(member_name), utf8(descriptor), 1)
+            out += struct.pack('>HI', code, 3) + b'\x00\x00\x00'
+        return out
+
+    body = struct.pack('>HHHH', access, this_index, super_index, len(interface_indexes))
+    body += b''.join(struct.pack('>H', i) for i in interface_indexes)
+    body += members(fields) + members(methods)
+    body += struct.pack('>H', 0)
+    return (b'\xca\xfe\xba\xbe' + struct.pack('>HHH', 0, 50, len(pool) + 1) +
+            b''.join(pool) + body)
+
+
+PUBLIC = mi.ACC_PUBLIC
+STATIC = mi.ACC_PUBLIC | mi.ACC_STATIC
+
+
+class TestMemberIndex(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.jar = os.path.join(self.dir, 'lib.jar')
+        zf = zipfile.ZipFile(self.jar, 'w')
+        zf.writestr('java/lang/Object.class', make_class(
+            'java/lang/Object', None, methods=[(PUBLIC, 'hashCode', '()I'),
+                                               (PUBLIC, '<init>', '()V')]))
+        zf.writestr('com/lib/Base.class', make_class(
+            'com/lib/Base', fields=[(PUBLIC, 'size', 'J'), (0x0002, 'secret', 'I')],
+            methods=[(PUBLIC, 'get', '(ILjava/lang/String;)[Ljava/util/Map$Entry;'),
+                     (mi.ACC_PROTECTED, 'hook', '()V')]))
+        zf.writestr('com/lib/Api.class', make_class(
+            'com/lib/Api', fields=[(STATIC, 'NAME', 'Ljava/lang/String;')],
+            methods=[(STATIC, 'of', '()Lcom/lib/Api;')], access=PUBLIC | 0x0200))
+        zf.writestr('com/lib/Impl.class', make_class(
+            'com/lib/Impl', 'com/lib/Base', interfaces=['com/lib/Api'], methods=[
+                (PUBLIC, 'get', '(ILjava/lang/String;)[Ljava/util/Map$Entry;'),
+                (STATIC, 'create', '()Lcom/lib/Impl;'),
+                (PUBLIC | mi.ACC_SYNTHETIC, 'access$000', '()V')]))
+        zf.writestr('com/lib/Hidden.class', make_class('com/lib/Hidden', access=0))
+        zf.close()
+        self.path = os.path.join(self.dir, 'lib.members')
+        mi.build(self.jar, self.path)
+        self.file = mi.MemberFile(self.path)
+        self.index = mi.MemberIndex([self.file])
+
+    def tearDown(self):
+        self.file.close()
+        shutil.rmtree(self.dir)
+
+    def test_signature(self):
+        self.assertEqual(mi.method_signature('(ILjava/lang/String;)[Ljava/util/Map$Entry;'),
+                         (['int', 'String'], 'Map.Entry[]'))
+
+    def test_lookup(self):
+        super_class, interfaces, members = self.index.get('com.lib.Impl')
+        self.assertEqual(super_class, 'com/lib/Base')
+        self.assertEqual([m[2] for m in members], ['get', 'create'])
+        self.assertEqual(self.index.get('com.lib.Hidden'), None)
+        self.assertEqual(self.index.get('com.lib.Missing'), None)
+        self.assertTrue(mi.is_current(self.jar, self.path))
+
+    def test_completions(self):
+        completions = self.index.completions('com.lib.Impl', static=False)
+        self.assertEqual(completions, [
+            ('get(int, String)\tMap.Entry[] - Impl', 'get(${1:int}, ${2:String})'),
+            ('create()\tImpl - Impl', 'create()'),
+            ('size\tlong - Base', 'size'),
+            ('NAME\tString - Api', 'NAME'),
+            ('hashCode()\tint - Object', 'hashCode()'),
+        ])
+        self.assertEqual(self.index.completions('com.lib.Impl', static=True), [
+            ('create()\tImpl - Impl', 'create()'),
+            ('NAME\tString - Api', 'NAME'),
+        ])
+
+    def test_protected(self):
+        displays = [d for d, _ in self.index.completions('com.lib.Impl', static=False, protected=True)]
+        self.assertTrue('hook()\tvoid - Base' in displays)
+
+    def test_interface_statics(self):
+        # called on the interface itself, not inherited by implementations
+        self.assertEqual(self.index.completions('com.lib.Api', static=True), [
+            ('NAME\tString - Api', 'NAME'),
+            ('of()\tApi - Api', 'of()'),
+        ])
+
+    def test_resolve_type(self):
+        known = self.index.__contains__
+        self.assertEqual(mi.resolve_type('Impl', 'org.app', ['com.lib.Impl'], known), 'com.lib.Impl')
+        self.assertEqual(mi.resolve_type('Impl', 'org.app', ['com.lib.*'], known), 'com.lib.Impl')
+        self.assertEqual(mi.resolve_type('Object', 'org.app', [], known), 'java.lang.Object')
+        self.assertEqual(mi.resolve_type('Unknown', 'org.app', ['com.lib.*'], known), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+'''Runs commands through a NailgunPool against fake_eclimd.py.
+
+    python -m unittest test_nailgun
+'''
+import os
+import sys
+import time
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import nailgun
+from fake_eclimd import FakeEclimd
+
+
+class SlowEclimd(FakeEclimd):
+    '''Takes a while to complete'''
+    def respond(self, args):
+        if 'java_complete' in args:
+            time.sleep(1.0)
+            return '[]', '', 0
+        return FakeEclimd.respond(self, args)
+
+
+class TestNailgunPool(unittest.TestCase):
+    def setUp(self):
+        self.server = SlowEclimd().start()
+        host, port = self.server.address
+        self.pool = nailgun.NailgunPool(host, port, size=1)
+        self.pool.fill()
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.close()
+
+    def test_run(self):
+        code, out, _ = self.pool.run(['-command', 'ping'])
+        self.assertEqual(code, 0)
+        self.assertTrue(out.startswith(b'eclim'))
+
+    def test_aborted_call_not_retried(self):
+        sockets = []
+        aborted = threading.Event()
+
+        def abort_later():
+            time.sleep(0.2)
+            aborted.set()
+            nailgun.abort(sockets[-1])
+        t = threading.Thread(target=abort_later)
+        t.daemon = True
+        t.start()
+        self.assertRaises(nailgun.NailgunError, self.pool.run, ['-command', 'java_complete'],
+                          sockets.append, aborted.is_set)
+        self.assertEqual(len(sockets), 1)
+        self.assertEqual(len(self.server.calls), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
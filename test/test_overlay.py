@@ -0,0 +1,99 @@
+'''Overlays buffer contents on temporary files and checks they are restored.
+
+    python -m unittest test_overlay
+'''
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import subclim_overlay
+
+
+class TestOverlay(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.saved_overlay_dir = subclim_overlay.overlay_dir
+        subclim_overlay.overlay_dir = os.path.join(self.dir, 'overlay')
+        self.path = os.path.join(self.dir, 'Foo.java')
+        subclim_overlay.write_file(self.path, b'class Foo {}\n')
+        os.utime(self.path, (1000000000, 1000000000))
+
+    def tearDown(self):
+        subclim_overlay.overlay_dir = self.saved_overlay_dir
+        shutil.rmtree(self.dir)
+
+    def read(self):
+        return subclim_overlay.read_file(self.path)
+
+    def test_restores_contents_and_mtime(self):
+        seen = subclim_overlay.overlay(self.path, b'class Foo { int x; }\n', self.read)
+        self.assertEqual(seen, b'class Foo { int x; }\n')
+        self.assertEqual(self.read(), b'class Foo {}\n')
+        self.assertEqual(os.stat(self.path).st_mtime, 1000000000)
+        self.assertEqual(os.listdir(subclim_overlay.overlay_dir), [])
+
+    def test_restores_after_error(self):
+        def fail():
+            raise ValueError()
+        self.assertRaises(ValueError, subclim_overlay.overlay, self.path, b'x', fail)
+        self.assertEqual(self.read(), b'class Foo {}\n')
+
+    def test_keeps_real_save(self):
+        def save():
+            subclim_overlay.write_file(self.path, b'class Foo { int saved; }\n')
+        subclim_overlay.overlay(self.path, b'class Foo { int x; }\n', save)
+        self.assertEqual(self.read(), b'class Foo { int saved; }\n')
+
+    def test_keeps_real_save_of_same_contents(self):
+        # on a file system with coarse timestamps, nothing but note_save
+        # tells this save from the overlay
+        def save():
+            subclim_overlay.note_save(self.path)
+            subclim_overlay.write_file(self.path, b'class Foo { int x; }\n')
+        subclim_overlay.overlay(self.path, b'class Foo { int x; }\n', save)
+        self.assertEqual(self.read(), b'class Foo { int x; }\n')
+
+    def test_not_while_saving(self):
+        # the editor announced a save, but has not written the file yet
+        subclim_overlay.note_save(self.path)
+        self.assertEqual(subclim_overlay.overlay(self.path, b'class Foo { int x; }\n', self.read),
+                         b'class Foo {}\n')
+        subclim_overlay.note_saved(self.path)
+        self.assertEqual(subclim_overlay.overlay(self.path, b'class Foo { int x; }\n', self.read),
+                         b'class Foo { int x; }\n')
+
+    def test_after_restore(self):
+        seen = []
+        subclim_overlay.overlay(self.path, b'class Foo { int x; }\n', self.read,
+                                lambda: seen.append(self.read()))
+        self.assertEqual(seen, [b'class Foo {}\n'])
+
+    def test_recover(self):
+        # what is left behind if Sublime dies while the file is overlaid
+        os.makedirs(subclim_overlay.overlay_dir)
+        backup = subclim_overlay.backup_path(self.path)
+        subclim_overlay.write_file(backup + '.orig', b'class Foo {}\n')
+        subclim_overlay.write_file(backup + '.overlay', subclim_overlay.digest(b'class Foo { int x; }\n'))
+        subclim_overlay.write_file(backup + '.path', self.path.encode('utf-8'))
+        subclim_overlay.write_file(self.path, b'class Foo { int x; }\n')
+        self.assertEqual(subclim_overlay.recover(), [self.path])
+        self.assertEqual(self.read(), b'class Foo {}\n')
+        self.assertEqual(os.listdir(subclim_overlay.overlay_dir), [])
+
+    def test_recover_keeps_later_changes(self):
+        os.makedirs(subclim_overlay.overlay_dir)
+        backup = subclim_overlay.backup_path(self.path)
+        subclim_overlay.write_file(backup + '.orig', b'class Foo {}\n')
+        subclim_overlay.write_file(backup + '.overlay', subclim_overlay.digest(b'class Foo { int x; }\n'))
+        subclim_overlay.write_file(backup + '.path', self.path.encode('utf-8'))
+        subclim_overlay.write_file(self.path, b'class Foo { int edited; }\n')
+        self.assertEqual(subclim_overlay.recover(), [])
+        self.assertEqual(self.read(), b'class Foo { int edited; }\n')
+        self.assertEqual(os.listdir(subclim_overlay.overlay_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
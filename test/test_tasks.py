@@ -0,0 +1,57 @@
+'''Checks the order and limits TaskScheduler runs tasks with.
+
+    python -m unittest test_tasks
+'''
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import subclim_tasks
+from subclim_tasks import TaskScheduler
+
+
+class TestTaskScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = TaskScheduler(workers=3, per_project=2)
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+
+    def blocking(self, started):
+        def task():
+            started.set()
+            self.release.wait(5)
+        return task
+
+    def run_task(self, priority, project):
+        done = threading.Event()
+        self.scheduler.put(done.set, priority, project)
+        return done.wait(2)
+
+    def test_interactive_not_limited_by_project(self):
+        for priority in (subclim_tasks.VALIDATION, subclim_tasks.BACKGROUND):
+            started = threading.Event()
+            self.scheduler.put(self.blocking(started), priority, 'P')
+            self.assertTrue(started.wait(2))
+        self.assertTrue(self.run_task(subclim_tasks.INTERACTIVE, 'P'))
+
+    def test_project_limit(self):
+        self.scheduler = TaskScheduler(workers=4, per_project=2)
+        for _ in range(2):
+            started = threading.Event()
+            self.scheduler.put(self.blocking(started), subclim_tasks.BACKGROUND, 'P')
+            self.assertTrue(started.wait(2))
+        # a worker is free, but P has two tasks running
+        done = threading.Event()
+        self.scheduler.put(done.set, subclim_tasks.VALIDATION, 'P')
+        self.assertTrue(self.run_task(subclim_tasks.VALIDATION, 'Q'))
+        self.assertFalse(done.is_set())
+        self.release.set()
+        self.assertTrue(done.wait(2))
+
+
+if __name__ == '__main__':
+    unittest.main()